@@ -23,9 +23,18 @@ class UserAdmin(BaseUserAdmin):
     ordering = ('-date_joined',)
 
 
+class ProductAdmin(admin.ModelAdmin):
+    """Product admin; bulk changes go through manage.py import_products and change_prices."""
+    list_display = ('name', 'barcode', 'category', 'cost', 'price', 'qty')
+    list_filter = ('category',)
+    list_select_related = ('category',)
+    search_fields = ('name', 'barcode')
+    ordering = ('name',)
+
+
 admin.site.register(User, UserAdmin)
 admin.site.register(Category)
-admin.site.register(Product)
+admin.site.register(Product, ProductAdmin)
 admin.site.register(Stock)
 admin.site.register(StockDetail)
 admin.site.register(Sale)
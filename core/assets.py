@@ -0,0 +1,160 @@
+"""Production static assets: minified, content-hashed and precompressed.
+
+``manage.py build_assets`` runs collectstatic through
+:class:`PrecompressedManifestStaticFilesStorage`, which minifies CSS (and JS
+when ``rjsmin`` is installed), writes every file under a content-hashed name
+listed in ``staticfiles.json`` and stores ``.gz`` (and ``.br`` when
+``brotli`` is installed) copies next to each text asset. ``{% static %}``
+then resolves to the hashed names.
+
+With ``POS_SERVE_STATIC`` enabled, :func:`serve` answers ``STATIC_URL``
+requests from ``STATIC_ROOT``, picking the precompressed variant the client
+accepts and marking hashed files as immutable, so a till only downloads an
+asset again after it has changed.
+"""
+import gzip
+import mimetypes
+import re
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.map', '.txt', '.html', '.xml')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+# Strings and /*! licence */ comments are kept verbatim; other comments go.
+_CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|/\*!.*?\*/)|/\*.*?\*/''', re.S)
+_CSS_PLACEHOLDER = re.compile('\x00(\\d+)\x00')
+_HASH_SUFFIX = re.compile(r'\.[0-9a-f]{12}(\.[^./]+)$')
+
+
+def minify_css(css):
+    """Strip comments and insignificant whitespace from a stylesheet."""
+    preserved = []
+
+    def stash(match):
+        if match.group(1) is None:
+            return ' '
+        preserved.append(match.group(1))
+        return f'\x00{len(preserved) - 1}\x00'
+
+    css = _CSS_TOKENS.sub(stash, css)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r' ?([{};,>]) ?', r'\1', css)
+    css = css.replace(': ', ':').replace(';}', '}')
+    return _CSS_PLACEHOLDER.sub(lambda match: preserved[int(match.group(1))], css).strip()
+
+
+def minify_js(js):
+    """Minify a script with rjsmin, or return it unchanged without it."""
+    return rjsmin.jsmin(js, keep_bang_comments=True) if rjsmin else js
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest storage that minifies on collect and precompresses on build."""
+
+    def _save(self, name, content):
+        # Hashed copies are written from the source files, so minify here
+        # rather than in save(); minifying already minified text is a no-op.
+        minify = MINIFIERS.get(Path(name).suffix)
+        if minify and not name.endswith('.min' + Path(name).suffix):
+            content.seek(0)
+            content = ContentFile(minify(content.read().decode('utf-8')).encode('utf-8'))
+        return super()._save(name, content)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in {*self.hashed_files, *self.hashed_files.values()}:
+            if name.endswith(COMPRESSIBLE) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        """Write ``name.gz`` (and ``name.br``) when they are worth serving."""
+        with self.open(name) as source:
+            data = source.read()
+        variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data)))
+        for suffix, compressed in variants:
+            if len(compressed) < len(data) * 0.95:
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(compressed))
+
+    def stored_name(self, name):
+        # Until build_assets has written a manifest, refer to the source names.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+
+def is_hashed(path):
+    """Whether ``path`` is the manifest's content-hashed name for a file."""
+    name = _HASH_SUFFIX.sub(r'\1', path)
+    return name != path and staticfiles_storage.hashed_files.get(name) == path
+
+
+def accepted_encodings(header):
+    """Content codings listed in an Accept-Encoding header (without q=0)."""
+    codings = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        if re.fullmatch(r'\s*q\s*=\s*0(\.0*)?\s*', params):
+            continue
+        codings.add(coding.strip().lower())
+    return codings
+
+
+def serve(request, path):
+    """Serve a collected static file, precompressed when the client allows."""
+    try:
+        fullpath = Path(staticfiles_storage.path(path))
+    except SuspiciousFileOperation:
+        raise Http404(f'"{path}" does not exist')
+    if not fullpath.is_file():
+        raise Http404(f'"{path}" does not exist')
+    stat = fullpath.stat()
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    content_type, encoding = mimetypes.guess_type(fullpath.name)
+    if encoding:
+        content_type = None
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    coding, variant = None, fullpath
+    for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+        candidate = fullpath.with_name(fullpath.name + suffix)
+        if name in accepted and candidate.is_file():
+            coding, variant = name, candidate
+            break
+
+    response = FileResponse(variant.open('rb'), content_type=content_type or 'application/octet-stream')
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = IMMUTABLE if is_hashed(path) else REVALIDATE
+    if coding:
+        response['Content-Encoding'] = coding
+    if fullpath.name.endswith(COMPRESSIBLE):
+        patch_vary_headers(response, ['Accept-Encoding'])
+    return response
@@ -1,20 +1,89 @@
+import uuid
+
+from django.conf import settings
 from django.contrib.auth.backends import BaseBackend
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
 from .models import User
 
+USER_CACHE_TIMEOUT = getattr(settings, 'POS_USER_CACHE_TIMEOUT', 300)
+# Caches kept by each worker process; invalidating a user in one would
+# leave the other processes serving the stale copy (see core.checks).
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def user_cache():
+    """The cache session users are kept in (``POS_USER_CACHE``), or None."""
+    alias = getattr(settings, 'POS_USER_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _version_key(user_id):
+    return f'auth:user-version:{user_id}'
+
+
+def _user_key(user_id, version):
+    return f'auth:user:{user_id}:{version}'
+
+
+def invalidate_user(user_id):
+    """Make the next request for ``user_id`` reload the user from the database.
+
+    Cached users are stored under a per-user version stamp; replacing the
+    stamp orphans every cached copy at once, including one being written by
+    a concurrent request that read the user before the change.
+    """
+    cache = user_cache()
+    if cache is not None:
+        cache.set(_version_key(user_id), uuid.uuid4().hex, None)
+
 
 class UsernameAuthBackend(BaseBackend):
     """Custom authentication backend using u_name field."""
-    
+
     def authenticate(self, request, u_name=None, password=None, **kwargs):
+        """Check a username/password pair with exactly one password hash.
+
+        A failed check raises PermissionDenied, which stops authenticate()
+        from falling through to ModelBackend and hashing the password again.
+        Unknown usernames still run the hasher once so they cannot be told
+        apart by response time.
+        """
+        if u_name is None or password is None:
+            return None
         try:
             user = User.objects.get(u_name=u_name)
-            if user.check_password(password):
-                return user
         except User.DoesNotExist:
-            return None
-    
+            User().set_password(password)
+            raise PermissionDenied
+        if user.check_password(password):
+            return user
+        raise PermissionDenied
+
     def get_user(self, user_id):
-        try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
+        """Load the session user, from the cache when possible.
+
+        Runs on every authenticated request. Saving, updating or deleting a
+        user (or changing their groups/permissions) bumps their version
+        stamp, so deactivation and role changes apply on the next request.
+        """
+        cache = user_cache()
+        if cache is None:
+            try:
+                user = User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            return user if user.is_active else None
+        version = cache.get(_version_key(user_id))
+        if version is None:
+            cache.add(_version_key(user_id), uuid.uuid4().hex, None)
+            version = cache.get(_version_key(user_id))
+        key = _user_key(user_id, version)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user if user.is_active else None
@@ -0,0 +1,248 @@
+"""Bulk product management: catalog import and mass price changes.
+
+:func:`import_products` reads the columns of the products export (see
+core.exports): ``barcode, name, category, cost, price`` and an optional
+``qty``, from CSV or newline-delimited JSON. The file is upserted by barcode
+in fixed-size batches; rows without a barcode (the export leaves it blank
+for products that have none) cannot be matched to a product and are
+skipped and counted. Each batch costs one locking query for the products
+already stored, one ``INSERT ... ON CONFLICT (barcode) DO UPDATE`` and one
+bulk INSERT of stock movements, so a catalog of 100k products loads in
+seconds with flat memory. Unknown category names are created.
+
+:func:`change_prices` reprices products, for example every product of some
+categories, by a percentage and/or an amount in a single UPDATE.
+
+Both bypass ``Product.save()`` and do its work in bulk instead. The
+products get one new catalog version per run, qty changes are recorded in
+the stock ledger, and the barcode cache and the live feed are updated once
+the transaction commits.
+"""
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import F, Max, Min, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from . import events, ledger, lookup
+from .checkout import CENT, InvalidCart, to_money
+from .models import Category, Product, Sequence, StockMovement
+
+# Columns an import overwrites on products already stored.
+UPDATE_FIELDS = ('name', 'category', 'cost', 'price', 'qty', 'version', 'cover_days')
+MAX_PRICE = Decimal('99999999.99')
+
+
+class ProductImportError(Exception):
+    """The file contains invalid rows; nothing was written."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f'{len(errors)} invalid row(s), first: line {errors[0][0]}: {errors[0][1]}')
+
+
+class ImportReport:
+    """Outcome of a product import."""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.without_barcode = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def _text(row, column, max_length, required=True):
+    value = str(row.get(column) or '').strip()
+    if required and not value:
+        raise ValueError(f'Missing {column}')
+    if len(value) > max_length:
+        raise ValueError(f'{column.capitalize()} is longer than {max_length} characters')
+    return value
+
+
+def _money(row, column):
+    try:
+        amount = to_money(row.get(column), column)
+    except InvalidCart as exc:
+        raise ValueError(str(exc))
+    if amount > MAX_PRICE:
+        raise ValueError(f'{column.capitalize()} is too large: {amount}')
+    return amount
+
+
+def parse_row(row):
+    """Return ``(barcode, name, category, cost, price, qty)`` or raise ValueError.
+
+    ``barcode``, ``category`` and ``qty`` are ``None`` when the row leaves
+    them blank.
+    """
+    if not isinstance(row, dict):
+        raise ValueError('Row is not an object')
+    barcode = _text(row, 'barcode', Product._meta.get_field('barcode').max_length, required=False) or None
+    name = _text(row, 'name', Product._meta.get_field('name').max_length)
+    category = _text(row, 'category', Category._meta.get_field('name').max_length, required=False) or None
+    cost = _money(row, 'cost')
+    price = _money(row, 'price')
+    qty = row.get('qty')
+    if qty not in (None, ''):
+        try:
+            qty = int(qty)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid qty: {qty!r}')
+        if qty < 0:
+            raise ValueError('Quantity cannot be negative')
+    else:
+        qty = None
+    return barcode, name, category, cost, price, qty
+
+
+def resolve_categories(names, categories):
+    """Add the ids of ``names`` to ``categories`` ({name: id}), creating missing ones."""
+    missing = {name for name in names if name and name not in categories}
+    if missing:
+        Category.objects.bulk_create([Category(name=name) for name in sorted(missing)], ignore_conflicts=True)
+        categories.update(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+
+
+def import_products(rows, batch_size=1000, skip_invalid=False, progress=None):
+    """Upsert ``rows`` (as yielded by ``receiving.iter_rows``) by barcode.
+
+    Products already stored take the row's name, category, cost and price,
+    and its qty if it has one (recorded in the ledger as an adjustment); new
+    products start with the row's qty, or none. When a barcode appears
+    twice, the later row wins; rows without one are counted on the report's
+    ``without_barcode`` and skipped. Invalid rows abort the import with
+    :class:`ProductImportError` unless ``skip_invalid`` is set, in which
+    case they are collected on the report and skipped. ``progress`` is
+    called with the report after each batch.
+    """
+    start = time.perf_counter()
+    rows = iter(rows)
+    report = ImportReport()
+    version = None
+    touched = []
+    barcodes = set()
+
+    with transaction.atomic():
+        categories = dict(Category.objects.values_list('name', 'id'))
+        while batch := list(islice(rows, batch_size)):
+            report.rows += len(batch)
+            parsed = {}
+            errors = []
+            for line_number, row in batch:
+                try:
+                    barcode, *values = parse_row(row)
+                except ValueError as exc:
+                    errors.append((line_number, str(exc)))
+                    continue
+                if barcode is None:
+                    report.without_barcode += 1
+                    continue
+                parsed[barcode] = values
+            if errors and not skip_invalid:
+                raise ProductImportError(errors)
+            report.errors.extend(errors)
+
+            if parsed:
+                if version is None:
+                    version = Sequence.objects.advance('catalog')
+                resolve_categories({category for _, category, *_ in parsed.values()}, categories)
+                # Locked so that checkouts cannot change qty between this
+                # read and the upsert.
+                stored = {
+                    barcode: (qty, velocity)
+                    for barcode, qty, velocity in Product.objects.select_for_update()
+                    .filter(barcode__in=parsed).values_list('barcode', 'qty', 'velocity')
+                }
+                products = []
+                for barcode, (name, category, cost, price, qty) in parsed.items():
+                    stored_qty, velocity = stored.get(barcode, (0, 0.0))
+                    qty = stored_qty if qty is None else qty
+                    products.append(Product(
+                        barcode=barcode, name=name, category_id=categories.get(category), cost=cost,
+                        price=price, qty=qty, version=version, cover_days=qty / velocity if velocity else None,
+                    ))
+                Product.objects.bulk_create(
+                    products, update_conflicts=True, unique_fields=['barcode'], update_fields=UPDATE_FIELDS,
+                )
+                now = timezone.now()
+                ledger.record(
+                    (product.pk, product.qty - stored.get(product.barcode, (0,))[0], StockMovement.ADJUSTMENT,
+                     'product import' if product.barcode in stored else 'opening balance', now)
+                    for product in products
+                )
+                touched.extend(product.pk for product in products)
+                # A product is counted once, however many batches list it.
+                report.updated += len(set(stored) - barcodes)
+                report.created += len(parsed) - len(stored)
+                barcodes.update(parsed)
+
+            report.elapsed = time.perf_counter() - start
+            if progress:
+                progress(report)
+
+        transaction.on_commit(lambda: lookup.invalidate(barcodes=barcodes))
+        events.products_changed(touched)
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def _decimal(value, name):
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'Invalid {name}: {value!r}')
+    if not number.is_finite():
+        raise ValueError(f'Invalid {name}: {value!r}')
+    return number
+
+
+def change_prices(products=None, percent=None, amount=None):
+    """Reprice ``products`` (a queryset, default all) in one UPDATE.
+
+    New prices are ``price * (1 + percent / 100) + amount``, rounded to the
+    cent and never negative; either change may be left out. A change that
+    would take a price over ``MAX_PRICE`` is refused with ValueError before
+    anything is written. Returns the number of products repriced.
+    """
+    if percent is None and amount is None:
+        raise ValueError('Give a percentage and/or an amount')
+    factor = 1 + _decimal(percent, 'percentage') / 100 if percent is not None else Decimal(1)
+    amount = _decimal(amount, 'amount').quantize(CENT) if amount is not None else Decimal(0)
+    # Beyond these bounds every non-zero price would end up over MAX_PRICE,
+    # or at zero.
+    if abs(factor) > MAX_PRICE / CENT:
+        raise ValueError(f'Percentage is too large: {percent}')
+    if abs(amount) > MAX_PRICE:
+        raise ValueError(f'Amount is too large: {amount}')
+    products = Product.objects.all() if products is None else products
+
+    with transaction.atomic():
+        version = Sequence.objects.advance('catalog')
+        bounds = products.aggregate(lowest=Min('price'), highest=Max('price'))
+        if bounds['highest'] is not None:
+            # The factor may be negative, so either end can become the top.
+            highest = max(price * factor + amount for price in bounds.values())
+            if highest.quantize(CENT) > MAX_PRICE:
+                raise ValueError(f'Prices would exceed {MAX_PRICE}')
+        price = F('price')
+        if factor != 1:
+            price = price * Value(factor)
+        if amount:
+            price = price + Value(amount)
+        count = products.update(price=Greatest(Round(price, 2), Value(Decimal('0.00'))), version=version)
+        # Every product repriced, and only those, now has this version.
+        ids = list(Product.objects.filter(version=version).values_list('pk', flat=True))
+        transaction.on_commit(lambda: lookup.invalidate(ids=ids))
+        events.products_changed(ids)
+    return count
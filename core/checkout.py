@@ -0,0 +1,178 @@
+"""Sale checkout: turn a cart into a Sale with its line items and stock moves.
+
+A checkout runs in one transaction and issues a fixed number of statements
+regardless of how it is split into lines: one query for the products, one
+conditional ``UPDATE ... SET qty = qty - n WHERE qty >= n`` per product (which
+also updates its sales velocity, see ``core.reorder``), one
+INSERT for the sale, one bulk INSERT for its details, one for its stock
+movements (see ``core.ledger``) and one upsert per sales rollup table (see
+``core.rollups``). Oversells are
+detected by the conditional update matching no row, so no ``SELECT ... FOR
+UPDATE`` is needed; row locks are taken in primary-key order to keep
+concurrent tills from deadlocking.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+
+from . import codes, events, ledger, lookup, reorder, rollups
+from .models import Product, Sale, SaleDetail, StockMovement
+
+CENT = Decimal('0.01')
+# The largest amount the money fields (max_digits=10, decimal_places=2) hold.
+MAX_AMOUNT = Decimal('99999999.99')
+
+
+class CheckoutError(Exception):
+    """Base class for carts that cannot be checked out."""
+
+
+class InvalidCart(CheckoutError):
+    """The cart is malformed or references unknown products."""
+
+
+class OutOfStock(CheckoutError):
+    """A line asks for more units than the product has on hand."""
+
+    def __init__(self, product, requested):
+        self.product = product
+        self.requested = requested
+        super().__init__(f'Not enough stock for {product.name} (requested {requested})')
+
+
+def to_money(value, field='amount'):
+    try:
+        amount = Decimal(str(value)).quantize(CENT)
+    except (InvalidOperation, ValueError):
+        raise InvalidCart(f'Invalid {field}: {value!r}')
+    if not amount.is_finite():
+        raise InvalidCart(f'Invalid {field}: {value!r}')
+    if amount < 0:
+        raise InvalidCart(f'{field.capitalize()} cannot be negative')
+    if amount > MAX_AMOUNT:
+        raise InvalidCart(f'{field.capitalize()} is too large: {amount}')
+    return amount
+
+
+def to_qty(value):
+    """``value`` as a whole number of units; raises ValueError for fractions."""
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(f'Invalid qty: {value!r}')
+    return int(value)
+
+
+def normalize_cart(items):
+    """Validate cart lines and merge repeated products.
+
+    ``items`` is an iterable of mappings with ``product`` (id), ``qty`` and an
+    optional per-line ``discount``. Returns ``{product_id: (qty, discount)}``.
+    """
+    lines = {}
+    for item in items:
+        try:
+            product_id = int(item['product'])
+            qty = to_qty(item['qty'])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCart(f'Invalid cart line: {item!r}')
+        if qty <= 0:
+            raise InvalidCart('Quantities must be positive')
+        discount = to_money(item.get('discount', 0), 'discount')
+        previous_qty, previous_discount = lines.get(product_id, (0, Decimal(0)))
+        lines[product_id] = (previous_qty + qty, previous_discount + discount)
+    if not lines:
+        raise InvalidCart('The cart is empty')
+    return lines
+
+
+def decrement_stock(products, quantities):
+    """Take ``quantities`` ({product_id: qty}) off hand, or raise OutOfStock."""
+    for product_id in sorted(quantities):
+        qty = quantities[product_id]
+        updated = Product.objects.filter(pk=product_id, qty__gte=qty).update(
+            qty=F('qty') - qty, **reorder.on_sale(Value(float(qty)), F('qty') - qty),
+        )
+        if not updated:
+            raise OutOfStock(products[product_id], qty)
+
+
+def quote(products, lines, discount):
+    """Price normalized ``lines`` against ``products`` ({id: Product}).
+
+    Returns the unsaved SaleDetail rows and the sale's ``total_price``, or
+    raises :class:`InvalidCart`.
+    """
+    unknown = sorted(set(lines) - set(products))
+    if unknown:
+        raise InvalidCart(f'Unknown products: {unknown}')
+    details = []
+    for product_id, (qty, line_discount) in lines.items():
+        price = products[product_id].price
+        total = price * qty - line_discount
+        if total < 0:
+            raise InvalidCart(f'Discount exceeds line total for {products[product_id].name}')
+        if total > MAX_AMOUNT:
+            raise InvalidCart(f'Line total is too large for {products[product_id].name}')
+        details.append(SaleDetail(
+            product_id=product_id, qty=qty, price=price,
+            discount=line_discount, total=total, cost=products[product_id].cost,
+        ))
+    total_price = sum(detail.total for detail in details) - discount
+    if total_price < 0:
+        raise InvalidCart('Discount exceeds sale total')
+    if total_price > MAX_AMOUNT:
+        raise InvalidCart('Sale total is too large')
+    return details, total_price
+
+
+async def aprice_cart(items, discount=0):
+    """Price a cart without checking it out, using the async ORM.
+
+    Returns ``(products, details, total_price)`` as :func:`quote` does; stock
+    is not reserved, so a later checkout can still raise :class:`OutOfStock`.
+    """
+    lines = normalize_cart(items)
+    discount = to_money(discount, 'discount')
+    products = await Product.objects.ain_bulk(lines)
+    details, total_price = quote(products, lines, discount)
+    return products, details, total_price
+
+
+def checkout(items, discount=0, code=None):
+    """Check out ``items`` and return the saved Sale.
+
+    ``Sale.total_price`` is the amount payable: the sum of line totals less
+    the sale-level ``discount``. Prices are always taken from the database.
+    Raises :class:`InvalidCart` or :class:`OutOfStock`; either way nothing
+    is written. Without a ``code``, one is allocated (see core.codes) and,
+    should it be taken already, the checkout is retried with another.
+    """
+    lines = normalize_cart(items)
+    discount = to_money(discount, 'discount')
+    for attempt in range(1, codes.ATTEMPTS + 1):
+        try:
+            return record_sale(lines, discount, code or codes.allocate('sale'))
+        except IntegrityError:
+            if code or attempt == codes.ATTEMPTS:
+                raise
+
+
+def record_sale(lines, discount, code):
+    """Write the sale of normalized ``lines`` under ``code``; see :func:`checkout`."""
+    with transaction.atomic():
+        products = Product.objects.in_bulk(lines)
+        details, total_price = quote(products, lines, discount)
+        decrement_stock(products, {pid: qty for pid, (qty, _) in lines.items()})
+        sale = Sale.objects.create(
+            code=code, total_price=total_price, discount=discount,
+        )
+        for detail in details:
+            detail.sale = sale
+        SaleDetail.objects.bulk_create(details)
+        ledger.record(
+            (detail.product_id, -detail.qty, StockMovement.SALE, sale.code, sale.date) for detail in details
+        )
+        rollups.record_sale(sale, details, products)
+        transaction.on_commit(lambda: lookup.invalidate(ids=list(lines)))
+        events.products_changed(list(lines))
+    return sale
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+from .backends import PROCESS_LOCAL_CACHES
+
+
+@register()
+def check_user_cache(app_configs, **kwargs):
+    """POS_USER_CACHE must name a cache shared by all worker processes."""
+    alias = getattr(settings, 'POS_USER_CACHE', None)
+    if not alias:
+        return []
+    if alias not in settings.CACHES:
+        return [Error(f'POS_USER_CACHE names an unknown cache {alias!r}.', id='core.E001')]
+    if settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f'POS_USER_CACHE uses the per-process cache {alias!r}.',
+            hint='Deactivating a user would not apply in the other worker processes until '
+                 'POS_USER_CACHE_TIMEOUT; use a shared cache (Redis, Memcached) or leave POS_USER_CACHE unset.',
+            id='core.E002',
+        )]
+    return []
@@ -0,0 +1,82 @@
+"""Human-readable sale and stock codes, numbered per store and day.
+
+Codes look like ``POS-S20261018-00042`` (``POS-S01-20261018-00042`` with
+``POS_CODES['STORE'] = '01'``). The ``POS-`` namespace is reserved for
+them: codes supplied by clients (offline tills, receiving imports) that
+start with it are rejected, so they can never take a number the server
+is about to hand out. Each worker process reserves a block of
+numbers at a time, with one UPDATE of that day's ``Sequence`` row (see
+``Sequence.objects.advance``), and hands them out from memory: most codes
+cost no query and take no database lock, and tills never retry on a unique
+violation. Numbers are unique and increase through the day, but are not
+gapless: workers draw from different blocks, and what is left of a block
+when a worker exits is never used.
+
+Reserve codes outside of a transaction, as checkout and receiving do: a
+block reserved in one that then rolls back would be handed out again. Both
+retry with a new code, up to ``ATTEMPTS`` times, if a code is taken all
+the same (by rows written before the namespace existed, say).
+"""
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Sequence
+
+_options = getattr(settings, 'POS_CODES', {})
+BLOCK_SIZE = _options.get('BLOCK_SIZE', 20)
+STORE = _options.get('STORE', '')
+NAMESPACE = _options.get('NAMESPACE', 'POS-')
+ATTEMPTS = 3
+PREFIXES = {'sale': 'S', 'stock': 'P'}
+
+
+class CodeAllocator:
+    """Hands out codes from per-day blocks reserved ``block_size`` at a time."""
+
+    def __init__(self, block_size=BLOCK_SIZE, store=STORE):
+        self.block_size = block_size
+        self.store = store
+        self._blocks = {}  # kind -> (sequence name, next number, last number)
+        self._lock = threading.Lock()
+
+    def allocate(self, kind, day=None):
+        """The next code of ``kind`` (``'sale'`` or ``'stock'``) for ``day``."""
+        day = day or timezone.localdate()
+        name = f'code:{kind}:{self.store}:{day:%Y%m%d}'
+        with self._lock:
+            current, number, last = self._blocks.get(kind, (None, 1, 0))
+            if current != name or number > last:
+                last = Sequence.objects.advance(name, self.block_size)
+                number = last - self.block_size + 1
+            self._blocks[kind] = (name, number + 1, last)
+        return self.format(kind, day, number)
+
+    def allocate_many(self, kind, count, day=None):
+        """``count`` codes of ``kind`` for ``day``, reserved with one query."""
+        if not count:
+            return []
+        day = day or timezone.localdate()
+        last = Sequence.objects.advance(f'code:{kind}:{self.store}:{day:%Y%m%d}', count)
+        return [self.format(kind, day, number) for number in range(last - count + 1, last + 1)]
+
+    def format(self, kind, day, number):
+        store = f'{self.store}-' if self.store else ''
+        return f'{NAMESPACE}{PREFIXES[kind]}{store}{day:%Y%m%d}-{number:05d}'
+
+
+allocator = CodeAllocator()
+
+
+def allocate(kind):
+    return allocator.allocate(kind)
+
+
+def allocate_many(kind, count):
+    return allocator.allocate_many(kind, count)
+
+
+def is_reserved(code):
+    """Whether ``code`` is in the namespace of codes the server allocates."""
+    return code.upper().startswith(NAMESPACE.upper())
@@ -0,0 +1,5 @@
+def navigation(request):
+    """Sidebar section to highlight, taken from the URL name (``user_list`` -> ``user``)."""
+    match = getattr(request, 'resolver_match', None)
+    url_name = match.url_name if match and match.url_name else ''
+    return {'nav_section': url_name.split('_')[0]}
@@ -0,0 +1,208 @@
+"""Live change feed for tills: product price/qty changes and new sales.
+
+Changes are published once their transaction commits (see core.signals,
+checkout and receiving) to a broker; ``/api/events/`` streams them to each
+connected till as server-sent events, so it can patch the rows that changed
+instead of reloading whole lists::
+
+    id: 42
+    event: product
+    data: {"id": 7, "name": "Cola", "barcode": "...", "price": "1.50", "qty": 11}
+
+The broker is chosen by ``POS_EVENTS['BACKEND']``. The default
+:class:`InProcessBroker` only reaches tills connected to the same process;
+a deployment with several worker processes plugs in a broker backed by a
+shared pub/sub (Redis, PostgreSQL LISTEN/NOTIFY) with the same interface
+(``publish``, ``subscribe``, ``since`` and ``last_id``). Streams are
+long-lived, so serve them under ASGI (pos_system.asgi), where an idle till
+costs no thread.
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+_options = getattr(settings, 'POS_EVENTS', {})
+BACKLOG = _options.get('BACKLOG', 1000)
+HEARTBEAT = _options.get('HEARTBEAT', 15)
+
+PRODUCT_FIELDS = ('id', 'name', 'barcode', 'price', 'qty')
+
+
+@dataclass(frozen=True)
+class Event:
+    id: int
+    kind: str
+    data: dict
+
+    def encode(self):
+        """The event in text/event-stream framing."""
+        return f'id: {self.id}\nevent: {self.kind}\ndata: {json.dumps(self.data, cls=DjangoJSONEncoder)}\n\n'
+
+
+# Sent instead of events a subscriber can no longer receive (it fell too far
+# behind, or resumed from an id the broker no longer has): reload everything,
+# then carry on from the reset event's id.
+RESET = 'reset'
+
+
+class Subscription:
+    """Events delivered to one subscriber's event loop, in order."""
+
+    def __init__(self, broker, queue_size):
+        self.broker = broker
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # Runs on the subscriber's loop, via call_soon_threadsafe.
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        """The next event, or ``None`` after ``timeout`` seconds without one."""
+        if self.overflowed and self.queue.empty():
+            return None
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fan events out to the subscribers of this process.
+
+    Keeps the last ``backlog`` events so a reconnecting till can resume from
+    its ``Last-Event-ID``; each subscriber buffers as many before it is
+    considered lost and told to reset.
+    """
+
+    def __init__(self, backlog=BACKLOG):
+        self.backlog = deque(maxlen=backlog)
+        self.subscribers = set()
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+    def publish(self, kind, data):
+        """Send an event to every subscriber; safe to call from any thread."""
+        with self._lock:
+            self.last_id += 1
+            event = Event(self.last_id, kind, data)
+            self.backlog.append(event)
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:  # the subscriber's loop has closed
+                self.unsubscribe(subscription)
+        return event
+
+    def subscribe(self):
+        """Start receiving events on the running event loop."""
+        subscription = Subscription(self, self.backlog.maxlen)
+        with self._lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscribers.discard(subscription)
+
+    def since(self, last_id):
+        """Events published after ``last_id``, or ``None`` if any were dropped."""
+        with self._lock:
+            oldest = self.backlog[0].id if self.backlog else self.last_id + 1
+            if not oldest - 1 <= last_id <= self.last_id:
+                return None
+            return [event for event in self.backlog if event.id > last_id]
+
+
+broker = import_string(_options.get('BACKEND', 'core.events.InProcessBroker'))()
+
+
+async def stream(last_id=None, heartbeat=HEARTBEAT):
+    """Yield the encoded feed: missed events after ``last_id``, then live ones.
+
+    A comment line is sent after ``heartbeat`` idle seconds so proxies keep
+    the connection open and dead clients are noticed.
+    """
+    subscription = broker.subscribe()
+    try:
+        sent = 0
+        if last_id is not None:
+            missed = broker.since(last_id)
+            if missed is None:
+                yield Event(broker.last_id, RESET, {}).encode()
+                return
+            for event in missed:
+                yield event.encode()
+                sent = event.id
+        while True:
+            event = await subscription.get(heartbeat)
+            if event is None and subscription.overflowed:
+                yield Event(broker.last_id, RESET, {}).encode()
+                return
+            if event is None:
+                yield ': keepalive\n\n'
+            elif event.id > sent:
+                yield event.encode()
+                sent = event.id
+    finally:
+        subscription.close()
+
+
+def product_payload(product):
+    return {field: getattr(product, field) for field in PRODUCT_FIELDS}
+
+
+def product_saved(product):
+    """Publish ``product``'s price and qty once the transaction commits."""
+    payload = product_payload(product)
+    transaction.on_commit(lambda: broker.publish('product', payload))
+
+
+def product_deleted(product_id):
+    transaction.on_commit(lambda: broker.publish('product', {'id': product_id, 'deleted': True}))
+
+
+def products_changed(ids):
+    """Publish the committed price and qty of products updated in bulk."""
+    if not ids:
+        return
+    if len(ids) > BACKLOG:
+        # More changes than a till can buffer: have tills reload instead.
+        transaction.on_commit(lambda: broker.publish(RESET, {}))
+        return
+
+    def publish():
+        for row in Product.objects.filter(pk__in=ids).values(*PRODUCT_FIELDS):
+            broker.publish('product', row)
+
+    transaction.on_commit(publish)
+
+
+def sale_created(sale):
+    payload = {
+        'id': sale.id,
+        'code': sale.code,
+        'date': sale.date,
+        'total_price': sale.total_price,
+        'discount': sale.discount,
+    }
+    transaction.on_commit(lambda: broker.publish('sale', payload))
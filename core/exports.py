@@ -0,0 +1,130 @@
+"""Streaming CSV/NDJSON exports of sales, stock and products.
+
+Rows are read with ``.iterator(chunk_size=...)`` and encoded one at a time,
+so an export uses flat memory and starts sending bytes as soon as the first
+chunk arrives, however many rows it covers.
+"""
+import csv
+import json
+from datetime import timedelta
+
+from .models import Product, Sale, SaleDetail, Stock, StockDetail
+from .rollups import start_of_day
+
+CHUNK_SIZE = 2000
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _date(value):
+    return value.isoformat() if value else ''
+
+
+# kind -> (queryset factory, date field for range filters, [(column, accessor)])
+EXPORTS = {
+    'sales': (
+        lambda: Sale.objects.order_by('date', 'id'),
+        'date',
+        [
+            ('code', lambda sale: sale.code),
+            ('date', lambda sale: _date(sale.date)),
+            ('total_price', lambda sale: sale.total_price),
+            ('discount', lambda sale: sale.discount),
+        ],
+    ),
+    'sale-details': (
+        lambda: SaleDetail.objects.select_related('product', 'sale').only(
+            'qty', 'price', 'discount', 'total',
+            'sale__code', 'sale__date', 'product__name', 'product__barcode',
+        ).order_by('sale__date', 'sale_id', 'id'),
+        'sale__date',
+        [
+            ('sale_code', lambda line: line.sale.code),
+            ('date', lambda line: _date(line.sale.date)),
+            ('barcode', lambda line: line.product.barcode or ''),
+            ('product', lambda line: line.product.name),
+            ('qty', lambda line: line.qty),
+            ('price', lambda line: line.price),
+            ('discount', lambda line: line.discount),
+            ('total', lambda line: line.total),
+        ],
+    ),
+    'stock-details': (
+        lambda: StockDetail.objects.filter(stock__status=Stock.RECEIVED).select_related('product', 'stock')
+        .only(
+            'qty', 'cost', 'discount', 'total',
+            'stock__code', 'stock__date', 'product__name', 'product__barcode',
+        ).order_by('stock__date', 'stock_id', 'id'),
+        'stock__date',
+        [
+            ('stock_code', lambda line: line.stock.code),
+            ('date', lambda line: _date(line.stock.date)),
+            ('barcode', lambda line: line.product.barcode or ''),
+            ('product', lambda line: line.product.name),
+            ('qty', lambda line: line.qty),
+            ('cost', lambda line: line.cost),
+            ('discount', lambda line: line.discount),
+            ('total', lambda line: line.total),
+        ],
+    ),
+    'products': (
+        lambda: Product.objects.select_related('category').only(
+            'name', 'barcode', 'cost', 'price', 'qty', 'category__name',
+        ).order_by('id'),
+        None,
+        [
+            ('barcode', lambda product: product.barcode or ''),
+            ('name', lambda product: product.name),
+            ('category', lambda product: product.category.name if product.category else ''),
+            ('cost', lambda product: product.cost),
+            ('price', lambda product: product.price),
+            ('qty', lambda product: product.qty),
+        ],
+    ),
+}
+
+
+class Echo:
+    """File-like object whose ``write`` returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def columns(kind):
+    return [name for name, _ in EXPORTS[kind][2]]
+
+
+def queryset(kind, start=None, end=None):
+    """Rows of ``kind`` in export order, optionally within a date range."""
+    factory, date_field, _ = EXPORTS[kind]
+    queryset = factory()
+    if date_field and start:
+        queryset = queryset.filter(**{f'{date_field}__gte': start_of_day(start)})
+    if date_field and end:
+        queryset = queryset.filter(**{f'{date_field}__lt': start_of_day(end + timedelta(days=1))})
+    return queryset
+
+
+def rows(kind, start=None, end=None):
+    """Yield each exported row of ``kind`` as a list, optionally by date range."""
+    accessors = EXPORTS[kind][2]
+    for obj in queryset(kind, start, end).iterator(chunk_size=CHUNK_SIZE):
+        yield [accessor(obj) for _, accessor in accessors]
+
+
+def stream(kind, fmt, start=None, end=None):
+    """Yield the encoded export one line at a time."""
+    header = columns(kind)
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows(kind, start, end):
+            yield writer.writerow(row)
+    elif fmt == 'ndjson':
+        for row in rows(kind, start, end):
+            yield json.dumps(dict(zip(header, row)), default=str) + '\n'
+    else:
+        raise ValueError(f'Unsupported export format {fmt!r}')
@@ -22,19 +22,30 @@ class LoginForm(forms.Form):
         })
     )
     
+    def __init__(self, request=None, *args, **kwargs):
+        self.request = request
+        self.user_cache = None
+        super().__init__(*args, **kwargs)
+    
     def clean(self):
         cleaned_data = super().clean()
         username = cleaned_data.get('username')
         password = cleaned_data.get('password')
         
         if username and password:
-            user = authenticate(u_name=username, password=password)
-            if user is None:
+            # The only password check for this attempt; the view logs in
+            # the user returned by get_user() instead of authenticating again.
+            self.user_cache = authenticate(self.request, u_name=username, password=password)
+            if self.user_cache is None:
                 raise forms.ValidationError('Invalid username or password')
-            if not user.is_active:
+            if not self.user_cache.is_active:
                 raise forms.ValidationError('This account is inactive')
         
         return cleaned_data
+    
+    def get_user(self):
+        """Return the user authenticated by a successful validation."""
+        return self.user_cache
 
 
 class UserForm(forms.ModelForm):
@@ -0,0 +1,231 @@
+"""Per-request query count, DB time, template time and latency.
+
+:class:`InstrumentationMiddleware` times each request and, through a
+``contextvars`` collector that follows the request into ``sync_to_async``
+threads, the queries it runs (an execute wrapper every connection gets in
+core.signals) and the templates it renders (the ``InstrumentedDjangoTemplates``
+backend). The totals are
+
+* sent back in a ``Server-Timing`` header, which browser dev tools show
+  next to the request, when ``POS_INSTRUMENTATION['SERVER_TIMING']`` is
+  set (off by default: it tells any client how the server spends its time);
+* added to an in-memory latency histogram per view, served to admins at
+  ``/api/metrics/`` (one per worker process, reset on restart);
+* logged with the request's SQL, grouped by statement so N+1 queries stand
+  out, when the request took at least ``SLOW_REQUEST_MS``.
+"""
+import contextvars
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the histogram buckets; slower requests go in a last,
+# unbounded one.
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Distinct statements kept per request for the slow-request log.
+MAX_STATEMENTS = 200
+
+current = contextvars.ContextVar('pos_request_timings', default=None)
+
+
+@dataclass
+class Timings:
+    """What one request has cost so far; times in seconds."""
+    start: float = field(default_factory=time.perf_counter)
+    queries: int = 0
+    db: float = 0.0
+    template: float = 0.0
+    statements: dict = field(default_factory=dict)  # sql -> [count, seconds]
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.db += seconds
+        statement = self.statements.get(sql)
+        if statement is not None:
+            statement[0] += 1
+            statement[1] += seconds
+        elif len(self.statements) < MAX_STATEMENTS:
+            self.statements[sql] = [1, seconds]
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the current request."""
+    timings = current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, time.perf_counter() - start)
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = current.get()
+        if timings is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend that adds render time to the current request.
+
+    Time spent rendering includes queries run by lazy querysets in the
+    template, which are also counted as DB time.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return InstrumentedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class LatencyHistogram:
+    """Request latency per view, bucketed, with mean query and render costs."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, total_ms, queries, db_ms, template_ms):
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = {
+                    'counts': [0] * (len(self.buckets) + 1),
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'queries': 0, 'db_ms': 0.0, 'template_ms': 0.0,
+                }
+            index = next((i for i, bound in enumerate(self.buckets) if total_ms <= bound), len(self.buckets))
+            stats['counts'][index] += 1
+            stats['count'] += 1
+            stats['total_ms'] += total_ms
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+            stats['queries'] += queries
+            stats['db_ms'] += db_ms
+            stats['template_ms'] += template_ms
+
+    def quantile(self, counts, q):
+        """Upper bound of the bucket holding the ``q`` quantile (None: unbounded)."""
+        rank = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        """Summary per view, slowest mean first."""
+        with self._lock:
+            views = {view: {**stats, 'counts': list(stats['counts'])} for view, stats in self._views.items()}
+        summary = {}
+        for view, stats in views.items():
+            count = stats['count']
+            summary[view] = {
+                'count': count,
+                'mean_ms': round(stats['total_ms'] / count, 3),
+                'max_ms': round(stats['max_ms'], 3),
+                'p50_ms': self.quantile(stats['counts'], 0.50),
+                'p95_ms': self.quantile(stats['counts'], 0.95),
+                'p99_ms': self.quantile(stats['counts'], 0.99),
+                'mean_queries': round(stats['queries'] / count, 2),
+                'mean_db_ms': round(stats['db_ms'] / count, 3),
+                'mean_template_ms': round(stats['template_ms'] / count, 3),
+                'buckets': {
+                    f'le_{bound}': n for bound, n in zip((*self.buckets, 'inf'), stats['counts'])
+                },
+            }
+        return dict(sorted(summary.items(), key=lambda item: -item[1]['mean_ms']))
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+histogram = LatencyHistogram()
+
+
+class InstrumentationMiddleware:
+    """Time each request; list it first in MIDDLEWARE so the total covers
+    every other middleware."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = getattr(settings, 'POS_INSTRUMENTATION', {})
+        self.server_timing = options.get('SERVER_TIMING', False)
+        self.slow_request_ms = options.get('SLOW_REQUEST_MS', 500)
+        self.slow_request_sql = options.get('SLOW_REQUEST_SQL', 10)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = Timings()
+        token = current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = Timings()
+        token = current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        # Streaming responses are timed up to their first byte.
+        total_ms = (time.perf_counter() - timings.start) * 1000
+        db_ms, template_ms = timings.db * 1000, timings.template * 1000
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        histogram.observe(view, total_ms, timings.queries, db_ms, template_ms)
+        if self.server_timing:
+            response['Server-Timing'] = (
+                f'db;dur={db_ms:.1f};desc="{timings.queries} queries", '
+                f'tpl;dur={template_ms:.1f}, total;dur={total_ms:.1f}'
+            )
+        if self.slow_request_ms is not None and total_ms >= self.slow_request_ms:
+            self.log_slow_request(request, response, view, total_ms, timings)
+        return response
+
+    def log_slow_request(self, request, response, view, total_ms, timings):
+        statements = sorted(timings.statements.items(), key=lambda item: -item[1][1])
+        lines = [
+            f'  {count}x {seconds * 1000:.1f} ms  {sql}'
+            for sql, (count, seconds) in statements[:self.slow_request_sql]
+        ]
+        logger.warning(
+            'Slow request: %s %s (%s) %s in %.1f ms, %d queries in %.1f ms, templates %.1f ms%s',
+            request.method, request.get_full_path(), view, response.status_code, total_ms,
+            timings.queries, timings.db * 1000, timings.template * 1000,
+            ''.join(f'\n{line}' for line in lines),
+        )
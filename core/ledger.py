@@ -0,0 +1,92 @@
+"""Stock movement ledger and snapshots.
+
+Every change to ``Product.qty`` made by checkout, receiving or an edit of
+the product is also appended to ``StockMovement``, so on-hand quantity can
+be derived from history. ``StockSnapshot`` rows store each product's
+balance at the end of a day (``manage.py snapshot_stock``, run nightly);
+the balance at any later point is the nearest snapshot plus the movements
+since, which an index on ``(product, date)`` keeps to a short range scan
+however long the history grows.
+
+``manage.py reconcile_stock`` compares ``Product.qty`` with the ledger for
+every product in a single query.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockMovement, StockSnapshot
+from .rollups import start_of_day
+
+BATCH_SIZE = 1000
+# Lower bound for movements of products without a snapshot.
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def record(movements):
+    """Append ``(product_id, qty, kind, reference, date)`` movements."""
+    StockMovement.objects.bulk_create(
+        [
+            StockMovement(product_id=product_id, qty=qty, kind=kind, reference=reference, date=date)
+            for product_id, qty, kind, reference, date in movements
+            if qty
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def with_balance(queryset=None, as_of=None):
+    """Annotate products with ``ledger_qty``, their on-hand qty per the ledger.
+
+    With ``as_of`` (a date), the balance at the end of that day; otherwise
+    the current balance.
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    snapshots = StockSnapshot.objects.filter(product=OuterRef('pk')).order_by('-date')
+    movements = StockMovement.objects.filter(product=OuterRef('pk'), date__gte=OuterRef('snapshot_through'))
+    if as_of is not None:
+        snapshots = snapshots.filter(date__lte=as_of)
+        movements = movements.filter(date__lt=start_of_day(as_of + timedelta(days=1)))
+    delta = movements.order_by().values('product').annotate(total=Sum('qty')).values('total')
+    return queryset.annotate(
+        snapshot_qty=Coalesce(Subquery(snapshots.values('qty')[:1]), Value(0)),
+        snapshot_through=Coalesce(Subquery(snapshots.values('taken_through')[:1]), Value(EPOCH)),
+    ).annotate(
+        ledger_qty=F('snapshot_qty') + Coalesce(Subquery(delta, output_field=IntegerField()), Value(0)),
+    )
+
+
+def take_snapshots(day=None):
+    """Store every product's balance at the end of ``day`` (default yesterday).
+
+    Returns the number of snapshots written; existing ones are replaced.
+    """
+    day = day or timezone.localdate() - timedelta(days=1)
+    taken_through = start_of_day(day + timedelta(days=1))
+    balances = with_balance(as_of=day).values_list('pk', 'ledger_qty').order_by('pk')
+    count = 0
+    batch = []
+    for product_id, qty in balances.iterator(chunk_size=BATCH_SIZE):
+        batch.append(StockSnapshot(product_id=product_id, date=day, qty=qty, taken_through=taken_through))
+        if len(batch) >= BATCH_SIZE:
+            count += _save_snapshots(batch)
+            batch = []
+    return count + _save_snapshots(batch)
+
+
+def _save_snapshots(snapshots):
+    StockSnapshot.objects.bulk_create(
+        snapshots, update_conflicts=True, unique_fields=['product', 'date'],
+        update_fields=['qty', 'taken_through'],
+    )
+    return len(snapshots)
+
+
+def discrepancies(queryset=None):
+    """Yield ``(product_id, name, qty, ledger_qty)`` where the two disagree."""
+    products = with_balance(queryset).exclude(qty=F('ledger_qty'))
+    yield from products.values_list('pk', 'name', 'qty', 'ledger_qty').order_by('pk').iterator(
+        chunk_size=BATCH_SIZE,
+    )
@@ -0,0 +1,151 @@
+"""In-process barcode resolution for the checkout scanner.
+
+Scans are answered from a per-process LRU cache of compact product payloads,
+so a repeat scan costs a dictionary lookup instead of a query plus model
+instantiation. Entries are evicted when products are saved or deleted (see
+``core.signals``) and by code paths that update stock in bulk; a short TTL
+bounds staleness for changes made by other worker processes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Product
+
+PAYLOAD_FIELDS = ('id', 'name', 'price', 'qty', 'barcode')
+
+# Cached marker for barcodes that resolved to no product.
+MISSING = object()
+
+
+def to_payload(row):
+    """Build the JSON payload for a ``values(*PAYLOAD_FIELDS)`` row."""
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'price': str(row['price']),
+        'qty': row['qty'],
+    }
+
+
+class BarcodeCache:
+    """Thread-safe LRU mapping barcode -> product payload with a TTL."""
+
+    def __init__(self, maxsize=4096, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._barcodes_by_id = {}
+        self._lock = threading.Lock()
+
+    def get(self, barcode):
+        """Return the cached payload, ``MISSING``, or ``None`` when not cached."""
+        with self._lock:
+            entry = self._entries.get(barcode)
+            if entry is None:
+                return None
+            expires, payload = entry
+            if expires < time.monotonic():
+                self._discard(barcode)
+                return None
+            self._entries.move_to_end(barcode)
+            return payload
+
+    def set(self, barcode, payload):
+        with self._lock:
+            self._discard(barcode)
+            self._entries[barcode] = (time.monotonic() + self.ttl, payload)
+            if payload is not MISSING:
+                self._barcodes_by_id[payload['id']] = barcode
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, barcodes=(), ids=()):
+        """Evict entries by barcode and/or by product id."""
+        with self._lock:
+            for pk in ids:
+                barcode = self._barcodes_by_id.get(pk)
+                if barcode is not None:
+                    self._discard(barcode)
+            for barcode in barcodes:
+                self._discard(barcode)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._barcodes_by_id.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, barcode):
+        entry = self._entries.pop(barcode, None)
+        if entry is not None and entry[1] is not MISSING:
+            self._barcodes_by_id.pop(entry[1]['id'], None)
+
+
+_options = getattr(settings, 'POS_BARCODE_CACHE', {})
+cache = BarcodeCache(
+    maxsize=_options.get('MAXSIZE', 4096),
+    ttl=_options.get('TTL', 30),
+)
+
+
+def resolve(barcode):
+    """Return the payload for ``barcode``, or ``None`` if no product has it."""
+    return resolve_many([barcode]).get(barcode)
+
+
+def resolve_many(barcodes):
+    """Resolve a batch of scanned barcodes with at most one query.
+
+    Returns a dict of barcode -> payload containing only the barcodes that
+    matched a product.
+    """
+    found, misses = _from_cache(barcodes)
+    if misses:
+        _fill(found, misses, Product.objects.filter(barcode__in=misses).values(*PAYLOAD_FIELDS))
+    return found
+
+
+async def aresolve(barcode):
+    """Async :func:`resolve`; cache hits never leave the event loop."""
+    return (await aresolve_many([barcode])).get(barcode)
+
+
+async def aresolve_many(barcodes):
+    """Async :func:`resolve_many`."""
+    found, misses = _from_cache(barcodes)
+    if misses:
+        rows = Product.objects.filter(barcode__in=misses).values(*PAYLOAD_FIELDS)
+        _fill(found, misses, [row async for row in rows])
+    return found
+
+
+def _from_cache(barcodes):
+    found = {}
+    misses = set()
+    for barcode in barcodes:
+        payload = cache.get(barcode)
+        if payload is None:
+            misses.add(barcode)
+        elif payload is not MISSING:
+            found[barcode] = payload
+    return found, misses
+
+
+def _fill(found, misses, rows):
+    """Cache queried ``rows`` into ``found``, and the rest of ``misses`` as missing."""
+    for row in rows:
+        payload = to_payload(row)
+        cache.set(row['barcode'], payload)
+        found[row['barcode']] = payload
+        misses.discard(row['barcode'])
+    for barcode in misses:
+        cache.set(barcode, MISSING)
+
+
+def invalidate(barcodes=(), ids=()):
+    cache.invalidate(barcodes=barcodes, ids=ids)
@@ -0,0 +1,589 @@
+import asyncio
+import json
+import queue
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import Future
+from decimal import Decimal
+
+from unittest import mock
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import get_hasher
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction, IntegrityError, OperationalError
+from django.db.models import Sum
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core import checkout, codes, lookup, rollups
+from core.models import User, Category, Product, Sale, Sequence
+from core.pagination import KeysetPaginator
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark dataset once a scenario finishes."""
+
+
+class Command(BaseCommand):
+    help = 'Run a performance benchmark against a throwaway dataset'
+
+    scenarios = ['pagination', 'barcode', 'checkout', 'login', 'render', 'contention', 'asgi', 'codes']
+    # Scenarios that commit from several threads, so cannot run inside one
+    # rolled-back transaction; they clean up after themselves instead.
+    committing = {'checkout', 'contention', 'asgi', 'codes'}
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios)
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+            help='Dataset sizes to benchmark (default: 10k 100k 1M)',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Timed repetitions per measurement; the median is reported',
+        )
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument(
+            '--scans', type=int, default=20_000,
+            help='Barcode scans per measurement in the barcode scenario',
+        )
+        parser.add_argument(
+            '--logins', type=int, default=50,
+            help='Login attempts in the login scenario',
+        )
+        parser.add_argument(
+            '--tills', type=int, nargs='+', default=[1, 4, 8],
+            help='Concurrent tills (threads) in the checkout scenario',
+        )
+        parser.add_argument(
+            '--sales', type=int, default=200,
+            help='Sales per till in the checkout scenario',
+        )
+        parser.add_argument(
+            '--readers', type=int, default=4,
+            help='Concurrent reader threads in the contention scenario',
+        )
+        parser.add_argument(
+            '--seconds', type=float, default=5,
+            help='Duration of each run in the contention scenario',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help='WSGI worker threads in the asgi scenario',
+        )
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='API requests per till in the asgi scenario',
+        )
+        parser.add_argument(
+            '--think', type=float, default=20,
+            help='Milliseconds a till waits between requests in the asgi scenario',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        scenario = getattr(self, f'bench_{options["scenario"]}')
+        if options['scenario'] in self.committing:
+            scenario()
+            return
+        # Every other scenario seeds inside one transaction that is rolled back,
+        # so benchmarks never leave rows behind in the configured database.
+        try:
+            with transaction.atomic():
+                scenario()
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure(self, func):
+        """Return the median wall time of ``func`` in milliseconds."""
+        timings = []
+        for _ in range(self.options['repeat']):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def report(self, label, value, unit='ms'):
+        number = f'{value:>10,}' if isinstance(value, int) else f'{value:>10,.3f}'
+        self.stdout.write(f'  {label:<40} {number} {unit}')
+
+    def bench_pagination(self):
+        """Keyset vs offset pagination at increasing table sizes."""
+        per_page = 50
+        listings = [
+            (Category, ['name', 'id'], self.seed_categories),
+            (User, ['-date_joined', '-id'], self.seed_users),
+        ]
+        for model, ordering, seed in listings:
+            for rows in sorted(self.options['rows']):
+                seed(rows)
+                queryset = model.objects.all()
+                paginator = KeysetPaginator(queryset, ordering, per_page=per_page)
+                ordered = queryset.order_by(*ordering)
+                self.stdout.write(f'{model.__name__}: {rows:,} rows')
+                for label, position in [('first', 0), ('middle', rows // 2), ('last', rows - per_page)]:
+                    cursor = None
+                    if position:
+                        cursor = paginator.encode_cursor(ordered[position - 1])
+                    self.report(
+                        f'keyset {label} page',
+                        self.measure(lambda: list(paginator.get_page(cursor))),
+                    )
+                    self.report(
+                        f'offset {label} page',
+                        self.measure(lambda: list(ordered[position:position + per_page])),
+                    )
+
+    def bench_barcode(self):
+        """Scans per second per worker for single and batched barcode lookups."""
+        scans = self.options['scans']
+        for rows in sorted(self.options['rows']):
+            self.seed_products(rows)
+            codes = [f'bench-{random.randrange(rows):08d}' for _ in range(scans)]
+            self.stdout.write(f'Product: {rows:,} rows, {scans:,} scans')
+
+            def scan_uncached():
+                for code in codes:
+                    lookup.cache.clear()
+                    lookup.resolve(code)
+
+            def scan_cached():
+                for code in codes:
+                    lookup.resolve(code)
+
+            def scan_batches():
+                for i in range(0, scans, 20):
+                    lookup.resolve_many(codes[i:i + 20])
+
+            for label, func in [('uncached', scan_uncached), ('cached', scan_cached),
+                                ('batches of 20, cached', scan_batches)]:
+                if func is scan_cached:
+                    lookup.cache.clear()
+                    lookup.cache.maxsize = max(lookup.cache.maxsize, rows)
+                    for i in range(0, scans, 500):
+                        lookup.resolve_many(codes[i:i + 500])
+                start = time.perf_counter()
+                func()
+                self.report(label, scans / (time.perf_counter() - start), 'scans/s')
+
+    def bench_checkout(self):
+        """Checkout throughput and latency with concurrent tills.
+
+        Runs against the configured database: SQLite by default, PostgreSQL
+        with POS_DB_ENGINE=postgresql (see settings.DATABASES).
+        """
+        products = 500
+        self.stdout.write(f'{self.describe_database()}, {products} products')
+        self.seed_products(products)
+        ids = list(Product.objects.filter(barcode__startswith='bench-').values_list('id', flat=True))
+        sale_ids = []
+        try:
+            for tills in self.options['tills']:
+                latencies, failures = [], {}
+                lock = threading.Lock()
+
+                def till():
+                    try:
+                        for _ in range(self.options['sales']):
+                            cart = [{'product': pid, 'qty': random.randint(1, 3)}
+                                    for pid in random.sample(ids, 5)]
+                            start = time.perf_counter()
+                            try:
+                                sale = checkout.checkout(cart)
+                            except (checkout.CheckoutError, OperationalError) as exc:
+                                with lock:
+                                    failures[type(exc).__name__] = failures.get(type(exc).__name__, 0) + 1
+                                continue
+                            elapsed = (time.perf_counter() - start) * 1000
+                            with lock:
+                                latencies.append(elapsed)
+                                sale_ids.append(sale.id)
+                    finally:
+                        connections.close_all()
+
+                threads = [threading.Thread(target=till) for _ in range(tills)]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                wall = time.perf_counter() - start
+
+                self.stdout.write(f'{tills} till(s) x {self.options["sales"]} sales')
+                self.report('throughput', len(latencies) / wall, 'sales/s')
+                if latencies:
+                    quantiles = statistics.quantiles(latencies, n=100)
+                    self.report('p50 latency', quantiles[49])
+                    self.report('p95 latency', quantiles[94])
+                for name, count in sorted(failures.items()):
+                    self.report(f'failed: {name}', count, 'sales')
+        finally:
+            self.discard_sales(sale_ids)
+
+    def bench_contention(self):
+        """SQLite read latency while tills check out, default vs tuned pragmas."""
+        if connection.vendor != 'sqlite':
+            raise CommandError('The contention scenario compares SQLite pragmas')
+        products = 500
+        self.seed_products(products)
+        ids = list(Product.objects.filter(barcode__startswith='bench-').values_list('id', flat=True))
+        tills = max(self.options['tills'])
+        configs = [
+            ('SQLite defaults', {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 20000}),
+            ('settings.POS_SQLITE_PRAGMAS', settings.POS_SQLITE_PRAGMAS),
+        ]
+        sale_ids = []
+        try:
+            for label, pragmas in configs:
+                with override_settings(POS_SQLITE_PRAGMAS=pragmas):
+                    # New connections pick up the pragmas; switching the
+                    # journal mode needs the database to itself.
+                    connections.close_all()
+                    self.stdout.write(f'{label}: {self.describe_database()}, {tills} till(s), '
+                                      f'{self.options["readers"]} reader(s)')
+                    reads, sales, failures = [], [], {}
+                    lock = threading.Lock()
+                    stop = threading.Event()
+                    day_start = rollups.start_of_day(timezone.localdate())
+
+                    def reader():
+                        try:
+                            while not stop.is_set():
+                                start = time.perf_counter()
+                                Product.objects.filter(pk=random.choice(ids)).values_list('qty').first()
+                                Sale.objects.filter(date__gte=day_start).aggregate(Sum('total_price'))
+                                elapsed = (time.perf_counter() - start) * 1000
+                                with lock:
+                                    reads.append(elapsed)
+                                time.sleep(0.005)  # a till between scans, not a tight loop
+                        finally:
+                            connections.close_all()
+
+                    def till():
+                        try:
+                            while not stop.is_set():
+                                cart = [{'product': pid, 'qty': 1} for pid in random.sample(ids, 5)]
+                                try:
+                                    sale = checkout.checkout(cart)
+                                except (checkout.CheckoutError, OperationalError) as exc:
+                                    with lock:
+                                        failures[type(exc).__name__] = failures.get(type(exc).__name__, 0) + 1
+                                    continue
+                                with lock:
+                                    sales.append(sale.id)
+                        finally:
+                            connections.close_all()
+
+                    threads = [threading.Thread(target=till) for _ in range(tills)]
+                    threads += [threading.Thread(target=reader) for _ in range(self.options['readers'])]
+                    for thread in threads:
+                        thread.start()
+                    time.sleep(self.options['seconds'])
+                    stop.set()
+                    for thread in threads:
+                        thread.join()
+                    sale_ids.extend(sales)
+
+                    seconds = self.options['seconds']
+                    self.report('reads', len(reads) / seconds, 'reads/s')
+                    if len(reads) > 1:
+                        quantiles = statistics.quantiles(reads, n=100)
+                        self.report('read p50 latency', quantiles[49])
+                        self.report('read p95 latency', quantiles[94])
+                    self.report('checkouts', len(sales) / seconds, 'sales/s')
+                    for name, count in sorted(failures.items()):
+                        self.report(f'failed: {name}', count, 'sales')
+        finally:
+            connections.close_all()
+            self.discard_sales(sale_ids)
+
+    def bench_asgi(self):
+        """Till API tail latency: WSGI worker threads vs one ASGI event loop.
+
+        Drives Django's own handlers in-process, the same request mix per
+        till (scan, price the cart, every tenth request a checkout): WSGI as
+        a threaded server runs it, ``--workers`` threads each serving one
+        request at a time; ASGI as one event loop serving every till.
+        """
+        products = 500
+        self.seed_products(products)
+        bench = Product.objects.filter(barcode__startswith='bench-')
+        ids = list(bench.values_list('id', flat=True))
+        codes = list(bench.values_list('barcode', flat=True))
+        cashier = User.objects.create_user(
+            u_name='bench-asgi', email='bench-asgi@pos.test', password='bench-password',
+            f_name='Bench', l_name='Asgi', role='CASHIER',
+        )
+        session = Client()
+        session.force_login(cashier)
+        think = self.options['think'] / 1000
+        urls = {
+            'scan': lambda: ('GET', reverse('barcode_lookup_api', args=[random.choice(codes)]), ''),
+            'price': lambda: ('POST', reverse('cart_price_api'), cart()),
+            'sale': lambda: ('POST', reverse('sale_create_api'), cart()),
+        }
+
+        def cart():
+            return json.dumps({'items': [{'product': pid, 'qty': 1} for pid in random.sample(ids, 5)]})
+
+        def requests():
+            for i in range(self.options['requests']):
+                yield urls['sale' if i % 10 == 9 else 'price' if i % 2 else 'scan']()
+
+        sale_ids = []
+
+        def record(response, latencies, start):
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code in (200, 201), response.status_code
+            if response.status_code == 201:
+                sale_ids.append(response.json()['id'])
+
+        def run_wsgi(tills):
+            latencies = []
+            jobs = queue.Queue()
+
+            def worker():
+                try:
+                    while (job := jobs.get()) is not None:
+                        client, request, future = job
+                        future.set_result(client.generic(*request, content_type='application/json'))
+                finally:
+                    connections.close_all()
+
+            def till():
+                client = Client()
+                client.cookies = session.cookies
+                for request in requests():
+                    start = time.perf_counter()
+                    future = Future()
+                    jobs.put((client, request, future))
+                    record(future.result(), latencies, start)
+                    time.sleep(think)
+
+            workers = [threading.Thread(target=worker) for _ in range(self.options['workers'])]
+            threads = [threading.Thread(target=till) for _ in range(tills)]
+            for thread in workers + threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for _ in workers:
+                jobs.put(None)
+            for thread in workers:
+                thread.join()
+            return latencies
+
+        async def run_asgi(tills):
+            latencies = []
+
+            async def till():
+                client = AsyncClient()
+                client.cookies = session.cookies
+                for request in requests():
+                    start = time.perf_counter()
+                    record(await client.generic(*request, content_type='application/json'), latencies, start)
+                    await asyncio.sleep(think)
+
+            await asyncio.gather(*(till() for _ in range(tills)))
+            return latencies
+
+        handlers = [
+            (f'WSGI, {self.options["workers"]} worker threads', run_wsgi),
+            ('ASGI, one event loop', lambda tills: asyncio.run(run_asgi(tills))),
+        ]
+        self.stdout.write(f'{self.describe_database()}, {products} products, '
+                          f'{self.options["requests"]} requests per till')
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for tills in self.options['tills']:
+                    for label, run in handlers:
+                        start = time.perf_counter()
+                        latencies = run(tills)
+                        wall = time.perf_counter() - start
+                        self.stdout.write(f'{label}, {tills} till(s)')
+                        self.report('throughput', len(latencies) / wall, 'requests/s')
+                        quantiles = statistics.quantiles(latencies, n=100)
+                        self.report('p50 latency', quantiles[49])
+                        self.report('p95 latency', quantiles[94])
+                        self.report('p99 latency', quantiles[98])
+        finally:
+            connections.close_all()
+            self.discard_sales(sale_ids)
+            cashier.delete()
+
+    def bench_codes(self):
+        """Sale code allocation by concurrent tills: max+1 vs reserved blocks."""
+        day = timezone.localdate()
+        prefix = f'BENCH{day:%Y%m%d}-'
+
+        def max_plus_one(allocator):
+            last = (Sale.objects.filter(code__startswith=prefix).order_by('-code')
+                    .values_list('code', flat=True).first())
+            return f'{prefix}{int(last[-5:]) + 1 if last else 1:05d}'
+
+        def reserved_block(allocator):
+            return prefix + allocator.allocate('sale', day)[-5:]
+
+        strategies = [('max+1, retry on collision', max_plus_one), ('reserved blocks', reserved_block)]
+        try:
+            for tills in self.options['tills']:
+                for label, next_code in strategies:
+                    Sale.objects.filter(code__startswith=prefix).delete()
+                    Sequence.objects.filter(name__startswith='code:sale:').delete()
+                    sales, retries, stop = [], [], threading.Event()
+                    lock = threading.Lock()
+
+                    def till():
+                        # One allocator per till, as if each were a worker process.
+                        allocator = codes.CodeAllocator()
+                        try:
+                            while not stop.is_set():
+                                try:
+                                    with transaction.atomic():
+                                        code = next_code(allocator)
+                                        Sale.objects.create(code=code, total_price=0)
+                                except (IntegrityError, OperationalError):
+                                    with lock:
+                                        retries.append(1)
+                                    continue
+                                with lock:
+                                    sales.append(code)
+                        finally:
+                            connections.close_all()
+
+                    threads = [threading.Thread(target=till) for _ in range(tills)]
+                    for thread in threads:
+                        thread.start()
+                    time.sleep(self.options['seconds'])
+                    stop.set()
+                    for thread in threads:
+                        thread.join()
+                    assert len(set(sales)) == len(sales), 'duplicate codes'
+                    self.stdout.write(f'{label}, {tills} till(s)')
+                    self.report('codes', len(sales) / self.options['seconds'], 'codes/s')
+                    self.report('collisions retried', len(retries), 'codes')
+        finally:
+            Sale.objects.filter(code__startswith=prefix).delete()
+            Sequence.objects.filter(name__startswith='code:sale:').delete()
+
+    def discard_sales(self, sale_ids):
+        """Delete benchmark sales and products, and recount today's rollups."""
+        Sale.objects.filter(pk__in=sale_ids).delete()
+        Product.objects.filter(barcode__startswith='bench-').delete()
+        rollups.rebuild(since=timezone.localdate())
+
+    def describe_database(self):
+        settings_dict = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+            mode = settings_dict['OPTIONS'].get('transaction_mode') or 'DEFERRED'
+            return f'sqlite database ({journal_mode} journal, {mode} transactions)'
+        pool = settings_dict['OPTIONS'].get('pool')
+        if pool:
+            return f'{connection.vendor} database (pool {pool})'
+        return f'{connection.vendor} database (CONN_MAX_AGE={settings_dict["CONN_MAX_AGE"]})'
+
+    def bench_login(self):
+        """CPU cost of the login view: password hashes and wall time per login."""
+        User.objects.create_user(
+            u_name='bench-login', email='bench-login@pos.test', password='bench-password',
+            f_name='Bench', l_name='Login', role='CASHIER',
+        )
+        logins = self.options['logins']
+        hasher = type(get_hasher())
+        self.stdout.write(f'{hasher.algorithm} hasher, {logins} logins')
+
+        def login(extra_authenticate=False):
+            response = Client().post(
+                reverse('login'), {'username': 'bench-login', 'password': 'bench-password'},
+            )
+            assert response.status_code == 302, response.status_code
+            if extra_authenticate:
+                authenticate(u_name='bench-login', password='bench-password')
+
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for label, extra in [('login view', False), ('previous flow (view + 2nd authenticate)', True)]:
+                with mock.patch.object(hasher, 'encode', autospec=True, side_effect=hasher.encode) as encode:
+                    start = time.perf_counter()
+                    for _ in range(logins):
+                        login(extra)
+                    elapsed = time.perf_counter() - start
+                self.stdout.write(label)
+                self.report('hashes per login', encode.call_count / logins, 'hashes')
+                self.report('time per login', elapsed / logins * 1000)
+                self.report('throughput', logins / elapsed, 'logins/s')
+
+    def bench_render(self):
+        """Render time of the user and category lists, with and without template caching."""
+        admin = User.objects.create_user(
+            u_name='bench-render', email='bench-render@pos.test', password='bench-password',
+            f_name='Bench', l_name='Render', role='ADMIN',
+        )
+        self.seed_users(100)
+        self.seed_categories(100)
+        client = Client()
+        client.force_login(admin)
+        uncached_templates = [{
+            **engine,
+            'OPTIONS': {**engine['OPTIONS'], 'loaders': [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ]},
+        } for engine in settings.TEMPLATES]
+
+        def render(name, cold):
+            if cold:
+                caches['template_fragments'].clear()
+            response = client.get(reverse(name))
+            assert response.status_code == 200, response.status_code
+
+        configs = [
+            ('uncached loader, cold fragments', {'TEMPLATES': uncached_templates}, True),
+            ('cached loader and fragments', {}, False),
+        ]
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for label, overrides, cold in configs:
+                with override_settings(**overrides):
+                    self.stdout.write(label)
+                    for name in ['user_list', 'category_list']:
+                        render(name, cold)
+                        self.report(name, self.measure(lambda: render(name, cold)))
+
+    def seed_products(self, rows):
+        start = Product.objects.count()
+        self.bulk_seed(Product, (
+            Product(name=f'Bench product {i}', cost=Decimal('1.00'), price=Decimal('1.50'),
+                    qty=1_000_000, barcode=f'bench-{i:08d}')
+            for i in range(start, rows)
+        ))
+
+    def seed_categories(self, rows):
+        start = Category.objects.count()
+        self.bulk_seed(Category, (Category(name=f'bench-{i:08d}') for i in range(start, rows)))
+
+    def seed_users(self, rows):
+        start = User.objects.count()
+        self.bulk_seed(User, (
+            User(u_name=f'bench-{i:08d}', email=f'bench-{i:08d}@pos.test',
+                 f_name='Bench', l_name=f'{i:08d}', password='!')
+            for i in range(start, rows)
+        ))
+
+    def bulk_seed(self, model, objects):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.options['batch_size']:
+                model.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch)
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Collect minified, content-hashed and precompressed static assets into STATIC_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Remove previously built files first')
+
+    def handle(self, *args, **options):
+        call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+        hashed = staticfiles_storage.hashed_files
+        self.stdout.write(self.style.SUCCESS(f'✓ Built {len(hashed)} static files into {settings.STATIC_ROOT}'))
+        for name in sorted(name for name in hashed if name.endswith(('.css', '.js')) and '/' not in name):
+            sizes = [
+                staticfiles_storage.size(variant) if staticfiles_storage.exists(variant) else None
+                for variant in (hashed[name], hashed[name] + '.gz', hashed[name] + '.br')
+            ]
+            variants = ', '.join(
+                f'{label} {size:,} B' for label, size in zip(('raw', 'gzip', 'brotli'), sizes) if size is not None
+            )
+            self.stdout.write(f'  {hashed[name]}: {variants}')
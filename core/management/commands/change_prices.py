@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bulk
+from core.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Change the price of all products, or of those in some categories, by a percentage and/or amount'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--percent', help='Percentage to add, e.g. 5 or -10')
+        parser.add_argument('--amount', help='Amount to add to each price, e.g. 0.20 or -0.05')
+        parser.add_argument('--category', action='append', default=[],
+                            help='Only products in this category (repeatable)')
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['category']:
+            categories = dict(Category.objects.filter(name__in=options['category']).values_list('name', 'id'))
+            unknown = sorted(set(options['category']) - set(categories))
+            if unknown:
+                raise CommandError(f'Unknown categories: {", ".join(unknown)}')
+            products = products.filter(category__in=categories.values())
+        try:
+            count = bulk.change_prices(products, percent=options['percent'], amount=options['amount'])
+        except ValueError as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(f'✓ Repriced {count} product(s)'))
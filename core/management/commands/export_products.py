@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import exports
+
+
+class Command(BaseCommand):
+    help = 'Write all products as CSV or NDJSON, in the format import_products reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Output file (default: standard output)')
+        parser.add_argument('--format', choices=exports.FORMATS, default='csv')
+
+    def handle(self, *args, **options):
+        lines = exports.stream('products', options['format'])
+        if not options['path']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        try:
+            with open(options['path'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(lines)
+        except OSError as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(f'✓ Exported products to {options["path"]}'))
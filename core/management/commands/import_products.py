@@ -0,0 +1,52 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bulk, receiving
+
+
+class Command(BaseCommand):
+    help = 'Create or update products by barcode from a CSV or newline-delimited JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with barcode, name, category, cost, price and optional qty columns')
+        parser.add_argument('--format', choices=receiving.FORMATS,
+                            help='File format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help='Skip invalid rows instead of aborting the import')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        fmt = options['format'] or ('json' if path.suffix in ('.json', '.jsonl', '.ndjson') else 'csv')
+        try:
+            with path.open('rb') as stream:
+                report = bulk.import_products(
+                    receiving.iter_rows(stream, fmt),
+                    batch_size=options['batch_size'],
+                    skip_invalid=options['skip_invalid'],
+                    progress=self.progress,
+                )
+        except OSError as exc:
+            raise CommandError(exc)
+        except receiving.InvalidFile as exc:
+            raise CommandError(f'Import aborted, nothing was written: {exc}')
+        except bulk.ProductImportError as exc:
+            for line_number, message in exc.errors[:20]:
+                self.stderr.write(f'  line {line_number}: {message}')
+            raise CommandError(f'Import aborted, nothing was written: {exc}')
+
+        for line_number, message in report.errors:
+            self.stdout.write(self.style.WARNING(f'  skipped line {line_number}: {message}'))
+        if report.without_barcode:
+            self.stdout.write(self.style.WARNING(
+                f'  skipped {report.without_barcode} row(s) without a barcode; edit those products one by one'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Imported {report.created} new and {report.updated} updated product(s)'
+        ))
+        self.stdout.write(f'  {report.rows} row(s) in {report.elapsed:.2f}s ({report.rows_per_second:,.0f} rows/s)')
+
+    def progress(self, report):
+        self.stdout.write(f'  {report.rows:,} row(s) read, {report.created + report.updated:,} written, '
+                          f'{report.elapsed:.1f}s')
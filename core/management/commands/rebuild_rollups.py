@@ -0,0 +1,23 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollup tables from the sale history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild days from this date on (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f'Invalid date: {options["since"]}')
+        rollups.rebuild(since)
+        scope = f'from {since}' if since else 'for all history'
+        self.stdout.write(self.style.SUCCESS(f'✓ Sales rollups rebuilt {scope}'))
@@ -0,0 +1,49 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import receiving
+
+
+class Command(BaseCommand):
+    help = 'Receive a supplier delivery from a CSV or newline-delimited JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with barcode, qty, cost and optional discount columns')
+        parser.add_argument('--format', choices=receiving.FORMATS,
+                            help='File format (default: from the file extension)')
+        parser.add_argument('--code',
+                            help='Stock code (default: generated), or that of the draft purchase order it fulfils')
+        parser.add_argument('--discount', default='0', help='Discount on the whole delivery')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help='Skip invalid rows instead of aborting the import')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        fmt = options['format'] or ('json' if path.suffix in ('.json', '.jsonl', '.ndjson') else 'csv')
+        try:
+            with path.open('rb') as stream:
+                report = receiving.receive(
+                    receiving.iter_rows(stream, fmt),
+                    code=options['code'],
+                    discount=options['discount'],
+                    batch_size=options['batch_size'],
+                    skip_invalid=options['skip_invalid'],
+                )
+        except OSError as exc:
+            raise CommandError(exc)
+        except receiving.InvalidFile as exc:
+            raise CommandError(f'Import aborted, nothing was written: {exc}')
+        except receiving.ReceivingError as exc:
+            for line_number, message in exc.errors[:20]:
+                self.stderr.write(f'  line {line_number}: {message}')
+            raise CommandError(f'Import aborted, nothing was written: {exc}')
+
+        for line_number, message in report.errors:
+            self.stdout.write(self.style.WARNING(f'  skipped line {line_number}: {message}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Received stock {report.stock.code}: {report.lines} line(s), {report.units} unit(s), '
+            f'total cost {report.stock.total_cost}'
+        ))
+        self.stdout.write(f'  {report.rows} row(s) in {report.elapsed:.2f}s ({report.rows_per_second:,.0f} rows/s)')
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import ledger
+
+
+class Command(BaseCommand):
+    help = 'Check Product.qty against the stock movement ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show', type=int, default=20, help='Mismatches to list (default: 20)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        mismatches = 0
+        for product_id, name, qty, ledger_qty in ledger.discrepancies():
+            mismatches += 1
+            if mismatches <= options['show']:
+                self.stdout.write(
+                    f'  product {product_id} ({name}): qty {qty}, ledger {ledger_qty} ({qty - ledger_qty:+d})'
+                )
+        elapsed = time.perf_counter() - start
+        if mismatches:
+            raise CommandError(f'{mismatches} product(s) disagree with the stock ledger ({elapsed:.2f}s)')
+        self.stdout.write(self.style.SUCCESS(f'✓ Product quantities match the stock ledger ({elapsed:.2f}s)'))
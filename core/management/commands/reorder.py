@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core import reorder
+
+
+class Command(BaseCommand):
+    help = 'List products running low on stock and optionally write draft purchase orders for them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cover-days', type=float, default=reorder.COVER_DAYS,
+                            help='Flag products with less than this many days of stock left')
+        parser.add_argument('--target-days', type=float, default=reorder.TARGET_DAYS,
+                            help='Order enough to last this many days')
+        parser.add_argument('--create', action='store_true', help='Write draft purchase orders, one per category')
+
+    def handle(self, *args, **options):
+        products = list(reorder.suggestions(options['cover_days'], options['target_days']))
+        for product in products:
+            self.stdout.write(
+                f'{product.name}: {product.qty} on hand, {product.current_velocity:.2f}/day, '
+                f'{product.current_cover:.1f} days left, order {int(product.order_qty)}'
+            )
+        if not options['create']:
+            self.stdout.write(self.style.SUCCESS(f'✓ {len(products)} product(s) to reorder'))
+            return
+        drafts = reorder.create_drafts(products)
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Wrote {len(drafts)} draft purchase order(s) for {len(products)} product(s)'
+        ))
+        for draft in drafts:
+            self.stdout.write(f'  {draft.code}')
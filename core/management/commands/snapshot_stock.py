@@ -0,0 +1,22 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import ledger
+
+
+class Command(BaseCommand):
+    help = "Store each product's on-hand quantity at the end of a day from the stock ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to snapshot (YYYY-MM-DD, default: yesterday)')
+
+    def handle(self, *args, **options):
+        day = None
+        if options['date']:
+            try:
+                day = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f'Invalid date: {options["date"]}')
+        count = ledger.take_snapshots(day)
+        self.stdout.write(self.style.SUCCESS(f'✓ Stored {count} stock snapshot(s)'))
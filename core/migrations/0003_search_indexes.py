@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from core import search
+
+
+def create_search_indexes(apps, schema_editor):
+    search.install(schema_editor.connection, rebuild=True)
+
+
+def drop_search_indexes(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_user_list_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_thumbnail',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='profile_thumbnail',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0005_image_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['date', 'id', 'total_price'], name='sales_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saledetail',
+            index=models.Index(fields=['product', 'sale', 'qty', 'total'], name='sale_details_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['date', 'id'], name='stocks_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockdetail',
+            index=models.Index(fields=['product', 'stock'], name='stock_details_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['role', 'is_active'], name='users_role_active_idx'),
+        ),
+        migrations.AlterField(
+            model_name='saledetail',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='sale_details', to='core.product'),
+        ),
+        migrations.AlterField(
+            model_name='stockdetail',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_details', to='core.product'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Min, Sum
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+
+
+def backfill_ledger(apps, schema_editor):
+    """Seed the ledger from receiving and sales history.
+
+    Products whose qty does not match that history (stock entered by hand)
+    get an opening-balance adjustment dated at their first movement.
+    """
+    Product = apps.get_model('core', 'Product')
+    StockDetail = apps.get_model('core', 'StockDetail')
+    SaleDetail = apps.get_model('core', 'SaleDetail')
+    StockMovement = apps.get_model('core', 'StockMovement')
+
+    def insert(rows):
+        batch = []
+        for product_id, date, qty, kind, reference in rows:
+            batch.append(StockMovement(product_id=product_id, date=date, qty=qty, kind=kind, reference=reference))
+            if len(batch) >= BATCH_SIZE:
+                StockMovement.objects.bulk_create(batch)
+                batch = []
+        StockMovement.objects.bulk_create(batch)
+
+    receipts = StockDetail.objects.values_list('product_id', 'stock__date', 'qty', 'stock__code')
+    insert((pid, date, qty, 'RECEIPT', code) for pid, date, qty, code in receipts.iterator(chunk_size=BATCH_SIZE))
+    sales = SaleDetail.objects.values_list('product_id', 'sale__date', 'qty', 'sale__code')
+    insert((pid, date, -qty, 'SALE', code) for pid, date, qty, code in sales.iterator(chunk_size=BATCH_SIZE))
+
+    history = {
+        row['product_id']: row
+        for row in StockMovement.objects.values('product_id').annotate(total=Sum('qty'), first=Min('date'))
+    }
+    openings = []
+    for product_id, qty in Product.objects.values_list('id', 'qty').iterator(chunk_size=BATCH_SIZE):
+        row = history.get(product_id, {'total': 0, 'first': timezone.now()})
+        if qty != row['total']:
+            openings.append((product_id, row['first'], qty - row['total'], 'ADJUSTMENT', 'opening balance'))
+    insert(openings)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_report_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('qty', models.IntegerField(verbose_name='Quantity change')),
+                ('kind', models.CharField(choices=[('RECEIPT', 'Receipt'), ('SALE', 'Sale'), ('ADJUSTMENT', 'Adjustment')], max_length=10)),
+                ('reference', models.CharField(blank=True, default='', max_length=50)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='core.product')),
+            ],
+            options={
+                'db_table': 'stock_movements',
+                'indexes': [models.Index(fields=['product', 'date', 'qty'], name='stock_movements_product_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('qty', models.IntegerField(verbose_name='Quantity')),
+                ('taken_through', models.DateTimeField()),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='core.product')),
+            ],
+            options={
+                'db_table': 'stock_snapshots',
+                'constraints': [models.UniqueConstraint(fields=('product', 'date'), name='stock_snapshots_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:46
+
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+# Sales older than this many velocity windows add under 1% to the average.
+HISTORY_WINDOWS = 5
+
+
+def backfill_velocity(apps, schema_editor):
+    """Seed each product's sales velocity from its recent sales."""
+    velocity_days = getattr(settings, 'POS_REORDER', {}).get('VELOCITY_DAYS', 14)
+    Product = apps.get_model('core', 'Product')
+    SaleDetail = apps.get_model('core', 'SaleDetail')
+    now = timezone.now()
+    clock = now.timestamp() / 86400
+    velocity = {}
+    recent = SaleDetail.objects.filter(sale__date__gte=now - timedelta(days=velocity_days * HISTORY_WINDOWS))
+    for product_id, date, qty in recent.values_list('product_id', 'sale__date', 'qty').iterator(chunk_size=BATCH_SIZE):
+        weight = math.exp((date.timestamp() / 86400 - clock) / velocity_days)
+        velocity[product_id] = velocity.get(product_id, 0) + qty * weight / velocity_days
+    products = list(Product.objects.filter(pk__in=velocity).only('qty'))
+    for product in products:
+        product.velocity = velocity[product.pk]
+        product.velocity_at = clock
+        product.cover_days = product.qty / product.velocity
+    Product.objects.bulk_update(products, ['velocity', 'velocity_at', 'cover_days'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_offline_tills'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cover_days',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='velocity',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='velocity_at',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='status',
+            field=models.CharField(choices=[('DRAFT', 'Draft purchase order'), ('RECEIVED', 'Received')], default='RECEIVED', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['cover_days'], name='products_cover_idx'),
+        ),
+        migrations.RunPython(backfill_velocity, migrations.RunPython.noop),
+    ]
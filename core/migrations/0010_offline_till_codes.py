@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-18 01:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_reorder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='client_code',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='till',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddConstraint(
+            model_name='sale',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_code__isnull', False)), fields=('till', 'client_code'), name='sales_till_client_code_uniq'),
+        ),
+    ]
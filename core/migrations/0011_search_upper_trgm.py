@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from core import search
+
+
+def index_upper_columns(apps, schema_editor):
+    # The trigram indexes used to cover the bare columns, which the
+    # UPPER(...) LIKE that icontains compiles to on PostgreSQL cannot use.
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        search.uninstall(connection)
+        search.install(connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_offline_till_codes'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_upper_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_search_upper_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saledetail',
+            name='cost',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+    ]
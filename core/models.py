@@ -1,8 +1,27 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.utils import timezone
 
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    
+    def update(self, **kwargs):
+        """Update the users and drop their cached copies (see core.backends).
+        
+        ``update()`` sends no ``post_save``, which otherwise does this.
+        """
+        from .backends import invalidate_user
+        
+        with transaction.atomic(using=self.db):
+            user_ids = list(self.values_list('pk', flat=True))
+            count = super().update(**kwargs)
+            transaction.on_commit(lambda: [invalidate_user(user_id) for user_id in user_ids], using=self.db)
+        return count
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     """Custom user manager."""
     
     def create_user(self, u_name, email, password=None, **extra_fields):
@@ -43,6 +62,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(unique=True, verbose_name='Email')
     password = models.CharField(max_length=255)  # Handled by AbstractBaseUser
     profile = models.ImageField(upload_to='profiles/', blank=True, null=True)
+    profile_thumbnail = models.CharField(max_length=64, blank=True, default='', editable=False)
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='GUEST')
     
     is_active = models.BooleanField(default=True)
@@ -58,6 +78,12 @@ class User(AbstractBaseUser, PermissionsMixin):
         db_table = 'users'
         verbose_name = 'User'
         verbose_name_plural = 'Users'
+        indexes = [
+            # Keyset pagination of the user list (newest first).
+            models.Index(fields=['-date_joined', '-id'], name='users_date_joined_id_idx'),
+            # Active users by role (cashier pickers, role-filtered lists).
+            models.Index(fields=['role', 'is_active'], name='users_role_active_idx'),
+        ]
     
     def __str__(self):
         return f"{self.f_name} {self.l_name} ({self.u_name})"
@@ -70,16 +96,75 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.role == 'ADMIN'
 
 
+class CategoryQuerySet(models.QuerySet):
+    """Category queryset with aggregated product totals."""
+    
+    def with_product_totals(self):
+        """Annotate product count, units on hand and stock value at cost.
+        
+        The totals are computed in the same query as the categories
+        themselves, so listing categories costs one query regardless of
+        how many rows are rendered.
+        """
+        money = DecimalField(max_digits=14, decimal_places=2)
+        return self.annotate(
+            product_count=Count('products'),
+            stock_qty=Coalesce(Sum('products__qty'), Value(0)),
+            stock_value=Coalesce(
+                Sum(F('products__qty') * F('products__cost'), output_field=money),
+                Value(0),
+                output_field=money,
+            ),
+        )
+
+
 class Category(models.Model):
     """Category model."""
     name = models.CharField(max_length=100, unique=True)
     
+    objects = CategoryQuerySet.as_manager()
+    
     class Meta:
         db_table = 'categories'
         verbose_name_plural = 'Categories'
     
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        # Tills cache category names with the catalog (see core.catalog).
+        with transaction.atomic():
+            Sequence.objects.advance('catalog')
+            return super().save(*args, **kwargs)
+
+
+class SequenceManager(models.Manager):
+    
+    def advance(self, name, count=1):
+        """Reserve the next ``count`` values of sequence ``name``; returns the last.
+        
+        The sequence row stays locked until the caller's transaction ends, so
+        values are committed in the order they were handed out.
+        """
+        with transaction.atomic():
+            if not self.filter(name=name).update(value=F('value') + count):
+                self.get_or_create(name=name)
+                self.filter(name=name).update(value=F('value') + count)
+            return self.filter(name=name).values_list('value', flat=True).get()
+
+
+class Sequence(models.Model):
+    """Named counter, e.g. the catalog version handed to offline tills."""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    
+    objects = SequenceManager()
+    
+    class Meta:
+        db_table = 'sequences'
+    
+    def __str__(self):
+        return f"{self.name} = {self.value}"
 
 
 class Product(models.Model):
@@ -90,24 +175,73 @@ class Product(models.Model):
     qty = models.IntegerField(default=0, verbose_name='Quantity')
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='products')
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image_thumbnail = models.CharField(max_length=64, blank=True, default='', editable=False)
     barcode = models.CharField(max_length=100, unique=True, blank=True, null=True)
+    # Catalog version of the last change to the fields tills cache offline.
+    version = models.BigIntegerField(default=0, editable=False)
+    # Moving average of units sold per day as of velocity_at (days since the
+    # epoch), and qty / velocity; maintained by checkout (see core.reorder).
+    velocity = models.FloatField(default=0, editable=False)
+    velocity_at = models.FloatField(default=0, editable=False)
+    cover_days = models.FloatField(null=True, editable=False)
+    
+    CATALOG_FIELDS = frozenset({'name', 'price', 'barcode', 'category', 'category_id'})
     
     class Meta:
         db_table = 'products'
+        indexes = [
+            # Catalog deltas for offline tills (changes since a version).
+            models.Index(fields=['version', 'id'], name='products_version_idx'),
+            # Low-stock candidates for reordering.
+            models.Index(fields=['cover_days'], name='products_cover_idx'),
+        ]
     
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        self.cover_days = self.qty / self.velocity if self.velocity else None
+        if update_fields is not None and 'qty' in update_fields:
+            update_fields = kwargs['update_fields'] = {*update_fields, 'cover_days'}
+        if update_fields is not None and not self.CATALOG_FIELDS.intersection(update_fields):
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            self.version = Sequence.objects.advance('catalog')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version'}
+            return super().save(*args, **kwargs)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets a save() record the change of qty in the stock ledger.
+        instance._loaded_qty = instance.__dict__.get('qty')
+        return instance
 
 
 class Stock(models.Model):
     """Stock/Purchase model."""
+    DRAFT = 'DRAFT'
+    RECEIVED = 'RECEIVED'
+    STATUS_CHOICES = [
+        (DRAFT, 'Draft purchase order'),
+        (RECEIVED, 'Received'),
+    ]
+    
     code = models.CharField(max_length=50, unique=True)
     date = models.DateTimeField(auto_now_add=True)
     total_cost = models.DecimalField(max_digits=10, decimal_places=2)
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Drafts are suggested orders (see core.reorder); they do not move stock.
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RECEIVED)
     
     class Meta:
         db_table = 'stocks'
+        indexes = [
+            # Date-range reports and exports, in (date, id) order.
+            models.Index(fields=['date', 'id'], name='stocks_date_id_idx'),
+        ]
     
     def __str__(self):
         return f"Stock {self.code}"
@@ -115,7 +249,7 @@ class Stock(models.Model):
 
 class StockDetail(models.Model):
     """Stock detail/line items."""
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_details')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_details', db_index=False)
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='details')
     qty = models.IntegerField(verbose_name='Quantity')
     cost = models.DecimalField(max_digits=10, decimal_places=2)
@@ -124,6 +258,10 @@ class StockDetail(models.Model):
     
     class Meta:
         db_table = 'stock_details'
+        indexes = [
+            # Receiving history of a product; also serves the product FK.
+            models.Index(fields=['product', 'stock'], name='stock_details_product_idx'),
+        ]
     
     def __str__(self):
         return f"{self.product.name} - Stock {self.stock.code}"
@@ -132,12 +270,28 @@ class StockDetail(models.Model):
 class Sale(models.Model):
     """Sale/Invoice model."""
     code = models.CharField(max_length=50, unique=True)
-    date = models.DateTimeField(auto_now_add=True)
+    # Set explicitly for sales rung up offline and uploaded later.
+    date = models.DateTimeField(default=timezone.now)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Sales uploaded by offline tills: the till and the code it gave the
+    # sale, which together make the upload idempotent (see core.offline).
+    till = models.CharField(max_length=50, blank=True, default='')
+    client_code = models.CharField(max_length=50, null=True, blank=True)
     
     class Meta:
         db_table = 'sales'
+        indexes = [
+            # Date-range reports, exports and rollup rebuilds, in (date, id)
+            # order; total_price makes it cover daily revenue totals.
+            models.Index(fields=['date', 'id', 'total_price'], name='sales_date_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['till', 'client_code'], condition=models.Q(client_code__isnull=False),
+                name='sales_till_client_code_uniq',
+            ),
+        ]
     
     def __str__(self):
         return f"Sale {self.code}"
@@ -145,15 +299,141 @@ class Sale(models.Model):
 
 class SaleDetail(models.Model):
     """Sale detail/line items."""
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sale_details')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sale_details', db_index=False)
     sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='details')
     qty = models.IntegerField(verbose_name='Quantity')
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total = models.DecimalField(max_digits=10, decimal_places=2)
+    # Unit cost when sold, for margins; empty on lines sold before it was kept.
+    cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     
     class Meta:
         db_table = 'sale_details'
+        indexes = [
+            # Units and revenue of a product over a date range of sales,
+            # read from the index alone; also serves the product FK.
+            models.Index(fields=['product', 'sale', 'qty', 'total'], name='sale_details_product_idx'),
+        ]
     
     def __str__(self):
         return f"{self.product.name} - Sale {self.sale.code}"
+
+
+class ProductTombstone(models.Model):
+    """A deleted product, so offline tills drop it on their next catalog sync."""
+    product_id = models.BigIntegerField()
+    version = models.BigIntegerField()
+    
+    class Meta:
+        db_table = 'product_tombstones'
+        indexes = [
+            models.Index(fields=['version'], name='product_tombstones_version_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Deleted product {self.product_id} (version {self.version})"
+
+
+class StockMovement(models.Model):
+    """Append-only ledger of changes to a product's on-hand quantity."""
+    RECEIPT = 'RECEIPT'
+    SALE = 'SALE'
+    ADJUSTMENT = 'ADJUSTMENT'
+    KIND_CHOICES = [
+        (RECEIPT, 'Receipt'),
+        (SALE, 'Sale'),
+        (ADJUSTMENT, 'Adjustment'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='movements', db_index=False)
+    date = models.DateTimeField(default=timezone.now)
+    qty = models.IntegerField(verbose_name='Quantity change')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    reference = models.CharField(max_length=50, blank=True, default='')
+    
+    class Meta:
+        db_table = 'stock_movements'
+        indexes = [
+            # Movements of a product since its latest snapshot.
+            models.Index(fields=['product', 'date', 'qty'], name='stock_movements_product_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} {self.qty:+d} ({self.kind})"
+
+
+class StockSnapshot(models.Model):
+    """On-hand quantity of a product at the end of a day, from the ledger."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='snapshots', db_index=False)
+    date = models.DateField()
+    qty = models.IntegerField(verbose_name='Quantity')
+    # Covers movements dated before this moment (the start of the next day).
+    taken_through = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'stock_snapshots'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='stock_snapshots_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} on hand {self.date}: {self.qty}"
+
+
+class DailySales(models.Model):
+    """Sales totals per day, maintained as sales are committed."""
+    date = models.DateField(unique=True)
+    sale_count = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'daily_sales'
+        verbose_name_plural = 'Daily sales'
+    
+    def __str__(self):
+        return f"Sales {self.date}"
+    
+    @property
+    def margin(self):
+        return self.revenue - self.cost
+
+
+class DailyProductSales(models.Model):
+    """Sales totals per day and product."""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'daily_product_sales'
+        verbose_name_plural = 'Daily product sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='daily_product_sales_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} sales {self.date}"
+
+
+class DailyCategorySales(models.Model):
+    """Sales totals per day and category (uncategorized products excluded)."""
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'daily_category_sales'
+        verbose_name_plural = 'Daily category sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='daily_category_sales_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.category_id} sales {self.date}"
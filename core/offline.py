@@ -0,0 +1,190 @@
+"""Offline till mode: a cacheable catalog and batched, idempotent sale sync.
+
+A till keeps a local copy of the catalog (see core.catalog), refreshed with
+deltas, and rings up sales against it when the store network is down.
+
+Sales made offline are queued on the till under codes it generates and
+uploaded in batches with :func:`upload_sales` once it is back online. The
+server stores each under a code of its own (see core.codes) and keeps the
+till's id and code next to it: a sale that till has already uploaded under
+that code is reported as a duplicate instead of being written again, so a
+till can retry an upload whose response it never received, while a code
+that happens to match another till's sale never is. A batch costs the same
+number of statements whether it holds one sale or hundreds.
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import codes, events, ledger, lookup, reorder, rollups
+from .checkout import MAX_AMOUNT, InvalidCart, to_money, to_qty
+from .models import Product, Sale, SaleDetail, StockMovement
+from .receiving import increment_stock
+
+MAX_SALES = getattr(settings, 'POS_OFFLINE_MAX_SALES', 500)
+
+
+class SyncError(Exception):
+    """The upload as a whole is malformed."""
+
+
+@dataclass
+class SyncReport:
+    """Outcome of an upload, by sale code."""
+    created: list = field(default_factory=list)
+    duplicates: list = field(default_factory=list)
+    rejected: list = field(default_factory=list)  # (code, reason)
+
+
+@dataclass
+class OfflineSale:
+    code: str
+    date: object
+    discount: Decimal
+    lines: dict  # product_id -> (qty, price, discount)
+
+    @property
+    def total_price(self):
+        return sum(price * qty - discount for qty, price, discount in self.lines.values()) - self.discount
+
+
+def parse_sale(entry):
+    """Validate one uploaded sale, or raise :class:`InvalidCart`.
+
+    ``entry`` is ``{"code", "date", "discount", "items": [{"product", "qty",
+    "price", "discount"}]}``; ``price`` is what the till charged, and
+    ``date`` (ISO 8601) when it did.
+    """
+    try:
+        date = parse_datetime(entry['date'])
+        items = list(entry['items'])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidCart('Each sale needs "date" and "items"')
+    if date is None:
+        raise InvalidCart(f'Invalid date: {entry["date"]!r}')
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    lines = {}
+    for item in items:
+        try:
+            product_id = int(item['product'])
+            qty = to_qty(item['qty'])
+            price = to_money(item['price'], 'price')
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCart(f'Invalid sale line: {item!r}')
+        if qty <= 0:
+            raise InvalidCart('Quantities must be positive')
+        discount = to_money(item.get('discount', 0), 'discount')
+        if product_id in lines:
+            previous_qty, previous_price, previous_discount = lines[product_id]
+            if previous_price != price:
+                raise InvalidCart(f'Product {product_id} sold at two prices')
+            qty, discount = previous_qty + qty, previous_discount + discount
+        if price * qty < discount:
+            raise InvalidCart(f'Discount exceeds line total for product {product_id}')
+        if price * qty - discount > MAX_AMOUNT:
+            raise InvalidCart(f'Line total is too large for product {product_id}')
+        lines[product_id] = (qty, price, discount)
+    if not lines:
+        raise InvalidCart('The sale has no items')
+    discount = to_money(entry.get('discount', 0), 'discount')
+    # A till whose clock runs ahead must not date sales in the future.
+    sale = OfflineSale(entry['code'], min(date, timezone.now()), discount, lines)
+    if sale.total_price < 0:
+        raise InvalidCart('Discount exceeds sale total')
+    if sale.total_price > MAX_AMOUNT:
+        raise InvalidCart('Sale total is too large')
+    return sale
+
+
+def upload_sales(entries, till):
+    """Store a batch of sales made offline by ``till``; returns a :class:`SyncReport`.
+
+    ``till`` identifies the till; the report lists sales by the codes it
+    gave them. Stock is taken off hand even where it goes negative (the
+    goods have already left the store); the ledger dates those movements
+    at upload, when the on-hand quantity changed.
+    """
+    if not isinstance(till, str) or not 0 < len(till) <= Sale._meta.get_field('till').max_length:
+        raise SyncError('"till" must be an id of at most 50 characters')
+    if not isinstance(entries, list):
+        raise SyncError('"sales" must be a list')
+    if len(entries) > MAX_SALES:
+        raise SyncError(f'At most {MAX_SALES} sales per upload')
+    report = SyncReport()
+    sales = {}
+    for entry in entries:
+        code = entry.get('code') if isinstance(entry, dict) else None
+        if not isinstance(code, str) or not 0 < len(code) <= Sale._meta.get_field('code').max_length:
+            report.rejected.append((code, 'Each sale needs a "code" of at most 50 characters'))
+            continue
+        if codes.is_reserved(code):
+            report.rejected.append((code, f'Codes starting with {codes.NAMESPACE!r} are reserved for the server'))
+            continue
+        if code in sales:
+            report.duplicates.append(code)
+            continue
+        try:
+            sales[code] = parse_sale(entry)
+        except InvalidCart as exc:
+            report.rejected.append((code, str(exc)))
+
+    # Allocated outside the transaction (see core.codes); codes left unused
+    # by duplicates are simply skipped.
+    server_codes = dict(zip(sales, codes.allocate_many('sale', len(sales))))
+
+    with transaction.atomic():
+        for code in Sale.objects.filter(till=till, client_code__in=sales).values_list('client_code', flat=True):
+            report.duplicates.append(code)
+            del sales[code]
+        products = Product.objects.only('cost', 'category_id').in_bulk(
+            {product_id for sale in sales.values() for product_id in sale.lines}
+        )
+        for code, sale in list(sales.items()):
+            unknown = sorted(set(sale.lines) - set(products))
+            if unknown:
+                report.rejected.append((code, f'Unknown products: {unknown}'))
+                del sales[code]
+        if not sales:
+            return report
+
+        saved = Sale.objects.bulk_create([
+            Sale(code=server_codes[sale.code], till=till, client_code=sale.code, date=sale.date,
+                 discount=sale.discount, total_price=sale.total_price)
+            for sale in sales.values()
+        ])
+        details = [
+            SaleDetail(sale=stored, product_id=product_id, qty=qty, price=price, discount=discount,
+                       total=price * qty - discount, cost=products[product_id].cost)
+            for stored, sale in zip(saved, sales.values())
+            for product_id, (qty, price, discount) in sale.lines.items()
+        ]
+        SaleDetail.objects.bulk_create(details)
+
+        sold = {}
+        for detail in details:
+            sold[detail.product_id] = sold.get(detail.product_id, 0) - detail.qty
+        increment_stock(sold)
+        reorder.record_sales({product_id: -qty for product_id, qty in sold.items()})
+        now = timezone.now()
+        ledger.record(
+            (detail.product_id, -detail.qty, StockMovement.SALE, detail.sale.code, now) for detail in details
+        )
+        rollups.record(
+            [(timezone.localdate(stored.date), stored.total_price) for stored in saved],
+            [
+                (timezone.localdate(detail.sale.date), detail.product_id,
+                 products[detail.product_id].category_id, detail.qty, detail.total, detail.cost * detail.qty)
+                for detail in details
+            ],
+        )
+        for stored in saved:
+            events.sale_created(stored)
+        events.products_changed(list(sold))
+        transaction.on_commit(lambda: lookup.invalidate(ids=list(sold)))
+    report.created.extend(sales)
+    return report
@@ -0,0 +1,122 @@
+import base64
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded for the paginated queryset."""
+
+
+class KeysetPage:
+    """One page of results plus the cursors needed to move around it."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Paginate a queryset by seeking past the last row seen.
+
+    Unlike offset pagination, fetching page N never scans the N-1 pages
+    before it: each page is a single indexed range query on ``ordering``,
+    so the cost is the same at any depth and any table size. The ordering
+    must be unique (end it with the primary key) and should be backed by
+    an index.
+
+    Cursors are opaque, URL-safe strings encoding the direction and the
+    ordering values of the boundary row, so they remain valid while rows
+    are inserted or deleted elsewhere in the table.
+    """
+
+    def __init__(self, queryset, ordering, per_page=50):
+        self.queryset = queryset
+        self.ordering = [
+            (name.lstrip('-'), name.startswith('-')) for name in ordering
+        ]
+        self.per_page = per_page
+
+    def get_page(self, cursor=None):
+        """Return the page for ``cursor``, or the first page if it is empty."""
+        backwards = False
+        queryset = self.queryset
+        if cursor:
+            backwards, values = self.decode_cursor(cursor)
+            queryset = queryset.filter(self._seek(values, backwards))
+
+        order_by = [
+            f'{"-" if descending != backwards else ""}{name}'
+            for name, descending in self.ordering
+        ]
+        rows = list(queryset.order_by(*order_by)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows)
+        next_cursor = previous_cursor = None
+        if has_more or backwards:
+            next_cursor = self.encode_cursor(rows[-1], backwards=False)
+        if cursor and (has_more or not backwards):
+            previous_cursor = self.encode_cursor(rows[0], backwards=True)
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def encode_cursor(self, obj, backwards=False):
+        opts = self.queryset.model._meta
+        values = [
+            opts.get_field(name).value_to_string(obj) for name, _ in self.ordering
+        ]
+        payload = json.dumps(['p' if backwards else 'n', values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        opts = self.queryset.model._meta
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(base64.urlsafe_b64decode(padded))
+            if direction not in ('n', 'p') or len(values) != len(self.ordering):
+                raise ValueError(cursor)
+            values = [
+                opts.get_field(name).to_python(value)
+                for (name, _), value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError) as exc:
+            raise InvalidCursor(f'Invalid cursor: {cursor!r}') from exc
+        return direction == 'p', values
+
+    def _seek(self, values, backwards):
+        """Build the row-value comparison ``(k1, k2, ...) > (v1, v2, ...)``.
+
+        Expanded as ``k1 >= v1 AND (k1 > v1 OR (k1 = v1 AND k2 > v2) OR ...)``
+        so it is portable across backends; the redundant leading bound lets
+        the planner turn it into a range scan on the ordering index.
+        """
+        clauses = []
+        for i, ((name, descending), value) in enumerate(zip(self.ordering, values)):
+            lookup = 'lt' if descending != backwards else 'gt'
+            equal = {n: v for (n, _), v in zip(self.ordering[:i], values[:i])}
+            clauses.append(Q(**equal, **{f'{name}__{lookup}': value}))
+        (name, descending), value = self.ordering[0], values[0]
+        bound = Q(**{f'{name}__{"lte" if descending != backwards else "gte"}': value})
+        return bound & reduce(lambda a, b: a | b, clauses)
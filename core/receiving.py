@@ -0,0 +1,234 @@
+"""Bulk stock receiving: import a supplier delivery into Stock/StockDetail.
+
+Rows are parsed lazily from CSV or newline-delimited JSON and processed in
+fixed-size batches, so memory stays flat however long the delivery is. Each
+batch costs one query to resolve barcodes, one bulk INSERT of StockDetail
+rows, one of stock movements (see ``core.ledger``) and one UPDATE adding the
+received quantities to ``Product.qty``; the whole delivery is written in a
+single transaction.
+
+A delivery against a draft purchase order (see ``core.reorder``) is
+received under the draft's code: the draft's lines are replaced by what
+actually arrived and it becomes a received stock.
+"""
+import csv
+import io
+import json
+import time
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Value, When
+from django.db.models.functions import NullIf
+from django.utils import timezone
+
+from . import codes, events, ledger, lookup
+from .checkout import InvalidCart, to_money, to_qty
+from .models import Product, Stock, StockDetail, StockMovement
+
+FORMATS = ('csv', 'json')
+
+
+class ReceivingError(Exception):
+    """The delivery contains invalid rows; nothing was written."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f'{len(errors)} invalid row(s), first: line {errors[0][0]}: {errors[0][1]}')
+
+
+class InvalidFile(Exception):
+    """The upload cannot be read as CSV or NDJSON at all."""
+
+    def __init__(self, line_number, message):
+        self.errors = [(line_number, message)]
+        super().__init__(f'Unreadable file at line {line_number}: {message}')
+
+
+class CodeTaken(Exception):
+    """Another stock already has the code."""
+
+
+class NotADraft(Exception):
+    """No open draft purchase order has the code."""
+
+
+class ReceivingReport:
+    """Outcome of a receiving import."""
+
+    def __init__(self, stock):
+        self.stock = stock
+        self.rows = 0
+        self.lines = 0
+        self.units = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def iter_rows(stream, fmt='csv'):
+    """Yield ``(line_number, row_dict)`` from a binary or text stream.
+
+    Raises :class:`InvalidFile` while iterating if the stream is not UTF-8
+    or not parseable as ``fmt`` at all.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported format {fmt!r}; expected one of {FORMATS}')
+    if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)) or 'b' in getattr(stream, 'mode', ''):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    line_number = 0
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(stream)
+            for row in reader:
+                line_number = reader.line_num
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(stream, start=1):
+                if line.strip():
+                    try:
+                        yield line_number, json.loads(line)
+                    except ValueError:
+                        yield line_number, None
+    except UnicodeDecodeError:
+        raise InvalidFile(line_number + 1, 'The file is not UTF-8 text')
+    except csv.Error as exc:
+        raise InvalidFile(line_number + 1, f'Invalid CSV: {exc}')
+
+
+def parse_row(row):
+    """Return ``(barcode, qty, cost, discount)`` or raise ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError('Row is not an object')
+    barcode = str(row.get('barcode') or '').strip()
+    if not barcode:
+        raise ValueError('Missing barcode')
+    try:
+        qty = to_qty(row.get('qty'))
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid qty: {row.get("qty")!r}')
+    if qty <= 0:
+        raise ValueError('Quantity must be positive')
+    try:
+        cost = to_money(row.get('cost'), 'cost')
+        discount = to_money(row.get('discount') or 0, 'discount')
+    except InvalidCart as exc:
+        raise ValueError(str(exc))
+    return barcode, qty, cost, discount
+
+
+def receive(rows, code=None, discount=0, batch_size=1000, skip_invalid=False):
+    """Import ``rows`` (as yielded by :func:`iter_rows`) as one Stock.
+
+    A ``code`` in the generated namespace must be that of a draft purchase
+    order, which the delivery then fulfils. Invalid rows (bad values or
+    unknown barcodes) abort the import with :class:`ReceivingError` unless
+    ``skip_invalid`` is set, in which case they are collected on the report
+    and skipped.
+    """
+    start = time.perf_counter()
+    try:
+        discount = to_money(discount, 'discount')
+    except InvalidCart as exc:
+        raise ReceivingError([(0, str(exc))])
+    draft = bool(code) and codes.is_reserved(code)
+    rows = iter(rows)
+    for attempt in range(1, codes.ATTEMPTS + 1):
+        try:
+            report = _receive(rows, code or codes.allocate('stock'), discount, batch_size, skip_invalid, draft)
+            break
+        except NotADraft:
+            raise ReceivingError([(0, f'{code!r} is not an open purchase order; codes starting with '
+                                      f'{codes.NAMESPACE!r} are reserved for generated codes')])
+        except CodeTaken:
+            # Nothing has been read from ``rows`` yet.
+            if code:
+                raise ReceivingError([(0, f'Stock code {code!r} is already used')])
+            if attempt == codes.ATTEMPTS:
+                raise ReceivingError([(0, 'Could not allocate a free stock code')])
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def _receive(rows, code, discount, batch_size, skip_invalid, draft=False):
+    touched = set()
+    with transaction.atomic():
+        if draft:
+            stock = Stock.objects.select_for_update().filter(code=code, status=Stock.DRAFT).first()
+            if stock is None:
+                raise NotADraft(code)
+            # The order's lines never moved stock; the delivery replaces them.
+            stock.details.all().delete()
+            stock.status, stock.discount, stock.date = Stock.RECEIVED, discount, timezone.now()
+            stock.save(update_fields=['status', 'discount', 'date'])
+        else:
+            try:
+                with transaction.atomic():
+                    stock = Stock.objects.create(code=code, total_cost=0, discount=discount)
+            except IntegrityError:
+                raise CodeTaken(code)
+        report = ReceivingReport(stock)
+        total_cost = 0
+        while batch := list(islice(rows, batch_size)):
+            report.rows += len(batch)
+            parsed = []
+            errors = []
+            for line_number, row in batch:
+                try:
+                    parsed.append((line_number, *parse_row(row)))
+                except ValueError as exc:
+                    errors.append((line_number, str(exc)))
+
+            product_ids = dict(
+                Product.objects.filter(barcode__in={line[1] for line in parsed})
+                .values_list('barcode', 'id')
+            )
+            details = []
+            received = {}
+            for line_number, barcode, qty, cost, line_discount in parsed:
+                product_id = product_ids.get(barcode)
+                if product_id is None:
+                    errors.append((line_number, f'Unknown barcode {barcode}'))
+                    continue
+                details.append(StockDetail(
+                    product_id=product_id, stock=stock, qty=qty, cost=cost,
+                    discount=line_discount, total=cost * qty - line_discount,
+                ))
+                received[product_id] = received.get(product_id, 0) + qty
+
+            if errors and not skip_invalid:
+                raise ReceivingError(sorted(errors))
+            report.errors.extend(sorted(errors))
+            if not details:
+                continue
+            StockDetail.objects.bulk_create(details)
+            ledger.record(
+                (detail.product_id, detail.qty, StockMovement.RECEIPT, stock.code, stock.date)
+                for detail in details
+            )
+            increment_stock(received)
+            touched.update(received)
+            report.lines += len(details)
+            report.units += sum(received.values())
+            total_cost += sum(detail.total for detail in details)
+
+        stock.total_cost = total_cost - discount
+        stock.save(update_fields=['total_cost'])
+        transaction.on_commit(lambda: lookup.invalidate(ids=touched))
+        events.products_changed(touched)
+    return report
+
+
+def increment_stock(quantities):
+    """Add ``quantities`` ({product_id: qty}) to on-hand stock in one UPDATE."""
+    qty = F('qty') + Case(
+        *(When(pk=product_id, then=Value(qty)) for product_id, qty in quantities.items()),
+        default=Value(0),
+    )
+    Product.objects.filter(pk__in=quantities).update(
+        qty=qty,
+        cover_days=ExpressionWrapper(qty / NullIf(F('velocity'), Value(0.0)), output_field=FloatField()),
+    )
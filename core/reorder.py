@@ -0,0 +1,136 @@
+"""Sales velocity, low-stock flags and draft purchase orders.
+
+Each product carries an exponentially weighted moving average of its sales
+rate (``Product.velocity``, units per day, averaged over about
+``VELOCITY_DAYS``). It is updated in the same UPDATE that takes sold units
+off hand, as ``v = v * exp(-elapsed / VELOCITY_DAYS) + units / VELOCITY_DAYS``,
+so it costs checkout no extra statement and concurrent tills cannot lose
+each other's updates. ``Product.cover_days`` (on-hand qty over velocity) is
+stored next to it and indexed, so finding the products about to run out
+is a range scan rather than a pass over all products and their sales.
+
+Velocity decays between sales, which only lengthens the real cover; the
+stored ``cover_days`` therefore never misses a product, and
+:func:`suggestions` recomputes the exact figures for the candidates it
+finds, in the same query. :func:`create_drafts` turns suggestions into
+draft ``Stock`` purchase orders, one per category, with bulk INSERTs. A
+draft stays open, keeping its products out of suggestions, until the
+delivery is received under its code (see ``core.receiving``).
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Value, When
+from django.db.models.functions import Ceil, Exp, NullIf
+from django.utils import timezone
+
+from . import codes
+from .models import Product, Stock, StockDetail
+
+_options = getattr(settings, 'POS_REORDER', {})
+VELOCITY_DAYS = _options.get('VELOCITY_DAYS', 14)
+COVER_DAYS = _options.get('COVER_DAYS', 7)
+TARGET_DAYS = _options.get('TARGET_DAYS', 28)
+
+
+def clock(now=None):
+    """``now`` as fractional days since the epoch, the unit of ``velocity_at``."""
+    return (now or timezone.now()).timestamp() / 86400
+
+
+def decayed_velocity(now):
+    """Expression for each product's velocity decayed to ``now`` (a clock)."""
+    return ExpressionWrapper(
+        F('velocity') * Exp((F('velocity_at') - Value(now)) / VELOCITY_DAYS), output_field=FloatField(),
+    )
+
+
+def on_sale(units, qty_after):
+    """UPDATE assignments folding ``units`` sold into velocity and cover.
+
+    ``units`` and ``qty_after`` (the on-hand qty once they are taken off)
+    are expressions, so one statement can cover several products.
+    """
+    now = clock()
+    velocity = decayed_velocity(now) + units / float(VELOCITY_DAYS)
+    return {
+        'velocity': velocity,
+        'velocity_at': Value(now),
+        'cover_days': ExpressionWrapper(qty_after / NullIf(velocity, Value(0.0)), output_field=FloatField()),
+    }
+
+
+def record_sales(quantities):
+    """Fold ``quantities`` ({product_id: units}) already taken off hand into velocity."""
+    if not quantities:
+        return
+    units = Case(
+        *(When(pk=product_id, then=Value(float(qty))) for product_id, qty in quantities.items()),
+        default=Value(0.0), output_field=FloatField(),
+    )
+    Product.objects.filter(pk__in=quantities).update(**on_sale(units, F('qty')))
+
+
+def low_stock(cover_days=COVER_DAYS):
+    """Products whose stored cover is under ``cover_days``; uses products_cover_idx."""
+    return Product.objects.filter(cover_days__lt=cover_days)
+
+
+def suggestions(cover_days=COVER_DAYS, target_days=TARGET_DAYS, now=None):
+    """Products to reorder, with ``order_qty`` to last ``target_days``.
+
+    Products on an open draft purchase order are left out. Each product
+    is annotated with its ``current_velocity`` and ``current_cover``; the
+    most urgent come first.
+    """
+    on_order = StockDetail.objects.filter(stock__status=Stock.DRAFT).values('product')
+    return (
+        low_stock(cover_days)
+        .exclude(pk__in=on_order)
+        .annotate(current_velocity=decayed_velocity(clock(now)))
+        .annotate(current_cover=ExpressionWrapper(
+            F('qty') / NullIf(F('current_velocity'), Value(0.0)), output_field=FloatField(),
+        ))
+        .filter(current_cover__lt=cover_days)
+        .annotate(order_qty=Ceil(F('current_velocity') * target_days - F('qty')))
+        .filter(order_qty__gt=0)
+        .order_by('current_cover', 'id')
+    )
+
+
+def create_drafts(products):
+    """Write draft purchase orders for suggested ``products``, one per category.
+
+    The products are locked first, and those another request has put on a
+    draft since they were suggested are left out, so concurrent calls do
+    not order the same product twice. Returns the created ``Stock`` rows.
+    """
+    products = {product.pk: product for product in products}
+    if not products:
+        return []
+    # Reserved before locking, so the code sequence is not held meanwhile.
+    stock_codes = codes.allocate_many('stock', len({product.category_id for product in products.values()}))
+    with transaction.atomic():
+        locked = list(Product.objects.select_for_update().filter(pk__in=products).order_by('pk')
+                      .values_list('pk', flat=True))
+        # A separate statement, so that drafts committed while waiting for
+        # the locks are seen.
+        on_order = set(StockDetail.objects.filter(stock__status=Stock.DRAFT, product__in=locked)
+                       .values_list('product', flat=True))
+        by_category = {}
+        for pk in locked:
+            if pk not in on_order:
+                by_category.setdefault(products[pk].category_id, []).append(products[pk])
+        if not by_category:
+            return []
+        drafts = Stock.objects.bulk_create([
+            Stock(code=code, status=Stock.DRAFT, discount=0,
+                  total_cost=sum(product.cost * int(product.order_qty) for product in lines))
+            for code, lines in zip(stock_codes, by_category.values())
+        ])
+        StockDetail.objects.bulk_create([
+            StockDetail(stock=draft, product=product, qty=int(product.order_qty), cost=product.cost,
+                        discount=0, total=product.cost * int(product.order_qty))
+            for draft, lines in zip(drafts, by_category.values())
+            for product in lines
+        ])
+    return drafts
@@ -0,0 +1,153 @@
+"""Daily sales rollups for the dashboard.
+
+Committed sales are folded into per-day, per-day-and-product and
+per-day-and-category summary rows in the same transaction as the sale, with
+one ``INSERT ... ON CONFLICT DO UPDATE`` per summary table. Reading KPIs for
+a date window then touches at most one row per day (and product/category),
+however many years of sales exist. ``manage.py rebuild_rollups`` recomputes
+the tables from the sale history.
+
+Revenue on the daily totals is net of sale-level discounts; product and
+category revenue is the sum of line totals. Cost is the product's cost at
+the time of sale, kept on each sale line so that a rebuild gives the same
+margins; lines sold before it was kept fall back to the current
+``Product.cost``.
+"""
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailySales, DailyProductSales, DailyCategorySales, Sale, SaleDetail
+
+BATCH_SIZE = 1000
+
+
+def _upsert(model, keys, rows):
+    """Add ``rows`` onto ``model``'s counters, inserting missing keys."""
+    if not rows:
+        return
+    table = model._meta.db_table
+    columns = [*keys, 'units', 'revenue', 'cost'] + (['sale_count'] if model is DailySales else [])
+    counters = columns[len(keys):]
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    updates = ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in counters)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) '
+                f'VALUES {", ".join([placeholders] * len(batch))} '
+                f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {updates}',
+                [value for row in batch for value in row],
+            )
+
+
+def start_of_day(day):
+    """Aware datetime at which local ``day`` starts.
+
+    Compare DateTimeFields against these bounds rather than with ``__date``
+    lookups, which wrap the column in a function and so cannot use an index.
+    """
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def record(sales, lines):
+    """Fold committed sales into the rollup tables.
+
+    ``sales`` is an iterable of ``(day, total_price)`` and ``lines`` of
+    ``(day, product_id, category_id, units, revenue, cost)``.
+    """
+    days, products, categories = {}, {}, {}
+    for day, total_price in sales:
+        units, revenue, cost, count = days.get(day, (0, 0, 0, 0))
+        days[day] = (units, revenue + total_price, cost, count + 1)
+    for day, product_id, category_id, units, revenue, cost in lines:
+        for totals, key in [(products, (day, product_id)), (categories, (day, category_id))]:
+            if key[1] is None:
+                continue
+            u, r, c = totals.get(key, (0, 0, 0))
+            totals[key] = (u + units, r + revenue, c + cost)
+        u, r, c, count = days.get(day, (0, 0, 0, 0))
+        days[day] = (u + units, r, c + cost, count)
+
+    _upsert(DailySales, ['date'], [(day, *totals) for day, totals in days.items()])
+    _upsert(DailyProductSales, ['date', 'product_id'], [(*key, *totals) for key, totals in products.items()])
+    _upsert(DailyCategorySales, ['date', 'category_id'], [(*key, *totals) for key, totals in categories.items()])
+
+
+def record_sale(sale, details, products):
+    """Fold one sale into the rollups; ``products`` maps id -> Product."""
+    day = timezone.localdate(sale.date)
+    record([(day, sale.total_price)], [
+        (day, detail.product_id, products[detail.product_id].category_id, detail.qty,
+         detail.total, detail.cost * detail.qty)
+        for detail in details
+    ])
+
+
+@transaction.atomic
+def rebuild(since=None):
+    """Recompute the rollups from the sale history, from ``since`` on."""
+    models = (DailySales, DailyProductSales, DailyCategorySales)
+    sales = Sale.objects.all()
+    details = SaleDetail.objects.all()
+    if since is not None:
+        sales = sales.filter(date__gte=start_of_day(since))
+        details = details.filter(sale__date__gte=start_of_day(since))
+        for model in models:
+            model.objects.filter(date__gte=since).delete()
+    else:
+        for model in models:
+            model.objects.all().delete()
+
+    day_sales = (
+        sales.annotate(day=TruncDate('date')).values('day')
+        .annotate(revenue=Sum('total_price'), count=Count('id'))
+        .values_list('day', 'revenue', 'count')
+    )
+    _upsert(DailySales, ['date'], [(day, 0, revenue, 0, count) for day, revenue, count in day_sales])
+
+    lines = (
+        details.annotate(day=TruncDate('sale__date'))
+        .values_list('day', 'product_id', 'product__category_id')
+        .annotate(units=Sum('qty'), revenue=Sum('total'), cost=Sum(F('qty') * Coalesce('cost', 'product__cost')))
+        .order_by()
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    while batch := list(islice(lines, BATCH_SIZE * 10)):
+        record([], batch)
+
+
+def dashboard(days=30):
+    """KPIs for today and the trailing ``days`` window, read from the rollups."""
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    window = DailySales.objects.filter(date__gte=start, date__lte=today)
+    totals = window.aggregate(
+        revenue=Sum('revenue'), cost=Sum('cost'), units=Sum('units'), sale_count=Sum('sale_count'),
+    )
+    totals = {key: value or 0 for key, value in totals.items()}
+    totals['margin'] = totals['revenue'] - totals['cost']
+    top_products = (
+        DailyProductSales.objects.filter(date__gte=start, date__lte=today)
+        .values('product_id', 'product__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-revenue')[:5]
+    )
+    top_categories = (
+        DailyCategorySales.objects.filter(date__gte=start, date__lte=today)
+        .values('category_id', 'category__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-revenue')[:5]
+    )
+    return {
+        'today': window.filter(date=today).first(),
+        'window_days': days,
+        'window': totals,
+        'top_products': list(top_products),
+        'top_categories': list(top_categories),
+    }
@@ -0,0 +1,178 @@
+"""Indexed full-text search for users, categories and products.
+
+On SQLite each searchable table gets an external-content FTS5 index kept in
+sync by triggers, so bulk writes (``bulk_create``, ``update()``) are indexed
+as well as ordinary saves. On PostgreSQL the searchable columns get pg_trgm
+GIN indexes on ``UPPER(column::text)``, the expression Django compiles
+``icontains`` to there, so those lookups can use them. Any other backend
+falls back to unindexed ``icontains``.
+"""
+import re
+from functools import reduce
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+# Searchable columns per table, in FTS5 column order.
+INDEXES = {
+    'users': ('f_name', 'l_name', 'u_name', 'email'),
+    'categories': ('name',),
+    'products': ('name', 'barcode'),
+}
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def fts_table(table):
+    return f'{table}_fts'
+
+
+def install(connection, rebuild=False):
+    """Create the search indexes for ``connection``'s backend.
+
+    With ``rebuild``, SQLite indexes are repopulated from their content
+    tables, which is needed the first time they are created over existing
+    rows.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for table, columns in INDEXES.items():
+                cols = ', '.join(columns)
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table(table)} USING fts5("
+                    f"{cols}, content='{table}', content_rowid='id', "
+                    f"tokenize='unicode61 remove_diacritics 2')"
+                )
+                if rebuild:
+                    cursor.execute(
+                        f"INSERT INTO {fts_table(table)}({fts_table(table)}) VALUES ('rebuild')"
+                    )
+            repair(connection)
+        elif connection.vendor == 'postgresql':
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for table, columns in INDEXES.items():
+                for column in columns:
+                    cursor.execute(
+                        f'CREATE INDEX IF NOT EXISTS {table}_{column}_trgm '
+                        f'ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+                    )
+
+
+def uninstall(connection):
+    """Drop the search indexes created by :func:`install`."""
+    with connection.cursor() as cursor:
+        for table, columns in INDEXES.items():
+            if connection.vendor == 'sqlite':
+                for suffix in ('ai', 'ad', 'au'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {fts_table(table)}_{suffix}')
+                cursor.execute(f'DROP TABLE IF EXISTS {fts_table(table)}')
+            elif connection.vendor == 'postgresql':
+                for column in columns:
+                    cursor.execute(f'DROP INDEX IF EXISTS {table}_{column}_trgm')
+
+
+def repair(connection):
+    """(Re)create the SQLite sync triggers for every existing FTS index.
+
+    Django alters SQLite tables by copying them into a new table and
+    dropping the original, which silently drops any triggers on it. This
+    runs after every ``migrate`` so schema changes never leave an index
+    stale.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    existing = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for table, columns in INDEXES.items():
+            fts = fts_table(table)
+            if fts not in existing:
+                continue
+            cols = ', '.join(columns)
+            new = ', '.join(f'new.{column}' for column in columns)
+            old = ', '.join(f'old.{column}' for column in columns)
+            insert = f'INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});'
+            delete = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} '
+                f'BEGIN {insert} END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} '
+                f'BEGIN {delete} END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} '
+                f'BEGIN {delete} {insert} END'
+            )
+
+
+def match_expression(query):
+    """Translate free text into an FTS5 query: every word, prefix-matched."""
+    terms = TOKEN_RE.findall(query)
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def _columns(queryset):
+    table = queryset.model._meta.db_table
+    if table not in INDEXES:
+        raise ValueError(f'{queryset.model.__name__} is not searchable')
+    return table, INDEXES[table]
+
+
+def _icontains(columns, query):
+    return reduce(lambda a, b: a | b, (Q(**{f'{column}__icontains': query}) for column in columns))
+
+
+def filter_queryset(queryset, query):
+    """Restrict ``queryset`` to rows matching ``query``, keeping its ordering."""
+    table, columns = _columns(queryset)
+    query = query.strip()
+    if not query:
+        return queryset
+    if connections[queryset.db].vendor != 'sqlite':
+        return queryset.filter(_icontains(columns, query))
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    fts = fts_table(table)
+    return queryset.filter(
+        pk__in=RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', [expression])
+    )
+
+
+def ranked(queryset, query, limit=20):
+    """Return up to ``limit`` rows of ``queryset`` matching ``query``, best first."""
+    table, columns = _columns(queryset)
+    query = query.strip()
+    # A negative LIMIT means no limit on SQLite.
+    if not query or limit < 1:
+        return []
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+        from django.db.models.functions import Greatest
+
+        similarity = [TrigramSimilarity(column, query) for column in columns]
+        rank = Greatest(*similarity) if len(similarity) > 1 else similarity[0]
+        return list(
+            queryset.filter(_icontains(columns, query))
+            .annotate(search_rank=rank)
+            .order_by('-search_rank')[:limit]
+        )
+    if connection.vendor != 'sqlite':
+        return list(queryset.filter(_icontains(columns, query))[:limit])
+
+    expression = match_expression(query)
+    if not expression:
+        return []
+    fts = fts_table(table)
+    with connection.cursor() as cursor:
+        # bm25() ranks rows where more of the terms hit short fields first.
+        cursor.execute(
+            f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s ORDER BY rank LIMIT %s',
+            [expression, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    rows = queryset.in_bulk(ids)
+    return [rows[pk] for pk in ids if pk in rows]
@@ -0,0 +1,126 @@
+import re
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import events, instrumentation, ledger, lookup, search, thumbnails
+from .backends import invalidate_user
+from .models import Category, Product, ProductTombstone, Sale, Sequence, StockMovement, User
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply ``settings.POS_SQLITE_PRAGMAS`` to each new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'POS_SQLITE_PRAGMAS', {}).items():
+            if not (re.fullmatch(r'\w+', name) and re.fullmatch(r'-?\w+', str(value))):
+                raise ValueError(f'Invalid SQLite pragma {name}={value!r}')
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def instrument_queries(sender, connection, **kwargs):
+    """Count and time queries for the request being served (see core.instrumentation)."""
+    if instrumentation.record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(instrumentation.record_query)
+
+
+def repair_search_indexes(sender, using, **kwargs):
+    """Restore FTS sync triggers dropped by SQLite table rebuilds."""
+    search.repair(connections[using])
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_barcode_cache(sender, instance, **kwargs):
+    # Evicted on commit: evicting now would let a concurrent lookup cache
+    # the row as it was before this transaction.
+    barcodes, ids = [instance.barcode], [instance.pk]
+    transaction.on_commit(lambda: lookup.invalidate(barcodes=barcodes, ids=ids))
+
+
+@receiver(post_save, sender=Product)
+def publish_product_change(sender, instance, **kwargs):
+    events.product_saved(instance)
+
+
+@receiver(post_delete, sender=Product)
+def publish_product_deletion(sender, instance, **kwargs):
+    events.product_deleted(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def record_product_tombstone(sender, instance, **kwargs):
+    """Let offline tills drop the product on their next catalog sync."""
+    ProductTombstone.objects.create(product_id=instance.pk, version=Sequence.objects.advance('catalog'))
+
+
+@receiver(pre_delete, sender=Category)
+def touch_category_products(sender, instance, **kwargs):
+    # The products lose their category with it, in an UPDATE that bypasses
+    # Product.save(); stamp them so offline tills pick up the change.
+    Product.objects.filter(category=instance).update(version=Sequence.objects.advance('catalog'))
+
+
+@receiver(post_save, sender=Sale)
+def publish_sale(sender, instance, created, **kwargs):
+    if created:
+        events.sale_created(instance)
+
+
+@receiver(post_save, sender=Product)
+def record_stock_adjustment(sender, instance, created, update_fields, **kwargs):
+    """Record qty set by saving a product (creation, admin edits) in the ledger."""
+    if update_fields is not None and 'qty' not in update_fields:
+        return
+    previous = 0 if created else instance.__dict__.get('_loaded_qty')
+    if previous is None:
+        return
+    reference = 'opening balance' if created else 'product edit'
+    ledger.record([(instance.pk, instance.qty - previous, StockMovement.ADJUSTMENT, reference, timezone.now())])
+    instance._loaded_qty = instance.qty
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_cached_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    user_ids = (pk_set or ()) if reverse else [instance.pk]
+    for user_id in user_ids:
+        invalidate_user(user_id)
+
+
+THUMBNAIL_SOURCES = {
+    Product: 'image',
+    User: 'profile',
+}
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=User)
+def reset_stale_thumbnail(sender, instance, **kwargs):
+    field_name = THUMBNAIL_SOURCES[sender]
+    image = getattr(instance, field_name)
+    if not image or not image._committed:
+        # Cleared or newly uploaded: drop the old hash so templates fall
+        # back to the original until the new thumbnails are ready.
+        setattr(instance, f'{field_name}_thumbnail', '')
+        instance._thumbnail_pending = bool(image)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=User)
+def schedule_thumbnails(sender, instance, **kwargs):
+    if instance.__dict__.pop('_thumbnail_pending', False):
+        thumbnails.schedule(sender, instance.pk, THUMBNAIL_SOURCES[sender])
@@ -0,0 +1,11 @@
+from django import template
+
+from core import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail_url(obj, field_name, size):
+    """URL of a thumbnail, e.g. {% thumbnail_url product 'image' 64 %}."""
+    return thumbnails.url(obj, field_name, size)
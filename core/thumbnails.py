@@ -0,0 +1,101 @@
+"""Thumbnails for product images and user profile photos.
+
+When a new image is uploaded, fixed-size thumbnails are rendered on a
+background worker pool once the upload has been committed, so the request
+that saved it does not pay for decoding and resizing. Thumbnail files are
+named after a hash of the source image (``thumbs/<hash>-<size>.webp``); the
+name changes whenever the image does, so they can be served with far-future
+cache headers. The hash is stored on the owning row (``<field>_thumbnail``)
+and :func:`url` falls back to the original image until it is set.
+"""
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+SIZES = tuple(getattr(settings, 'POS_THUMBNAIL_SIZES', (64, 256)))
+WORKERS = getattr(settings, 'POS_THUMBNAIL_WORKERS', 2)
+
+if features.check('webp'):
+    FORMAT, EXTENSION = 'WEBP', 'webp'
+else:
+    FORMAT, EXTENSION = 'JPEG', 'jpg'
+
+_executor = None
+
+
+def thumbnail_name(digest, size):
+    return f'thumbs/{digest}-{size}.{EXTENSION}'
+
+
+def url(obj, field_name, size):
+    """URL of ``obj``'s ``size`` thumbnail, or of the original while pending."""
+    image = getattr(obj, field_name)
+    if not image:
+        return ''
+    digest = getattr(obj, f'{field_name}_thumbnail', '')
+    if digest and size in SIZES:
+        return image.storage.url(thumbnail_name(digest, size))
+    return image.url
+
+
+def render(source, size):
+    """Return ``source`` image bytes scaled to fit a ``size`` square."""
+    with Image.open(io.BytesIO(source)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if FORMAT == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB' if FORMAT == 'JPEG' else 'RGBA')
+        output = io.BytesIO()
+        image.save(output, FORMAT, quality=80)
+        return output.getvalue()
+
+
+def generate(model, pk, field_name):
+    """Render the thumbnails for one row and record their hash on it."""
+    obj = model.objects.filter(pk=pk).first()
+    image = getattr(obj, field_name, None)
+    if not image:
+        return
+    with image.open('rb'):
+        source = image.read()
+    digest = hashlib.sha256(source).hexdigest()[:16]
+    for size in SIZES:
+        name = thumbnail_name(digest, size)
+        if not image.storage.exists(name):
+            image.storage.save(name, ContentFile(render(source, size)))
+    setattr(obj, f'{field_name}_thumbnail', digest)
+    obj.save(update_fields=[f'{field_name}_thumbnail'])
+
+
+def _run(model, pk, field_name):
+    try:
+        generate(model, pk, field_name)
+    except Exception:
+        logger.exception('Thumbnail generation failed for %s %s', model.__name__, pk)
+    finally:
+        connections.close_all()
+
+
+def schedule(model, pk, field_name):
+    """Generate thumbnails for a row once the current transaction commits.
+
+    Runs on the worker pool, or inline when ``POS_THUMBNAIL_WORKERS`` is 0.
+    """
+    def submit():
+        global _executor
+        if not WORKERS:
+            generate(model, pk, field_name)
+            return
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='thumbnails')
+        _executor.submit(_run, model, pk, field_name)
+
+    transaction.on_commit(submit)
@@ -17,4 +17,24 @@ urlpatterns = [
     path('categories/create/', views.category_create_view, name='category_create'),
     path('categories/<int:category_id>/update/', views.category_update_view, name='category_update'),
     path('categories/<int:category_id>/delete/', views.category_delete_view, name='category_delete'),
+    
+    # Reports
+    path('reports/export/<slug:kind>.<slug:fmt>', views.report_export_view, name='report_export'),
+    
+    # Monitoring
+    path('api/metrics/', views.metrics_api, name='metrics_api'),
+    
+    # POS APIs
+    path('api/products/search/', views.product_search_api, name='product_search_api'),
+    path('api/products/barcode/', views.barcode_bulk_lookup_api, name='barcode_bulk_lookup_api'),
+    path('api/products/barcode/<str:barcode>/', views.barcode_lookup_api, name='barcode_lookup_api'),
+    path('api/cart/price/', views.cart_price_api, name='cart_price_api'),
+    path('api/sales/', views.sale_create_api, name='sale_create_api'),
+    path('api/events/', views.events_api, name='events_api'),
+    path('api/catalog/', views.catalog_api, name='catalog_api'),
+    path('api/offline/sales/', views.offline_sales_api, name='offline_sales_api'),
+    path('api/products/import/', views.product_import_api, name='product_import_api'),
+    path('api/products/prices/', views.product_prices_api, name='product_prices_api'),
+    path('api/stock/receive/', views.stock_receive_api, name='stock_receive_api'),
+    path('api/stock/reorder/', views.reorder_api, name='reorder_api'),
 ]
@@ -1,10 +1,25 @@
+import json
+from datetime import date
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.db.models import Q
-from .models import User, Category
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+from . import bulk, catalog, checkout, events, exports, instrumentation, lookup, offline, receiving, reorder, rollups, search
+from .models import User, Category, Product
 from .forms import LoginForm, UserForm, CategoryForm
+from .pagination import InvalidCursor, KeysetPaginator
+
+PAGE_SIZE = 50
+MAX_BULK_BARCODES = 500
 
 
 def is_admin(user):
@@ -12,25 +27,33 @@ def is_admin(user):
     return user.is_authenticated and user.role == 'ADMIN'
 
 
+def is_manager(user):
+    """Check if user is a manager or admin."""
+    return user.is_authenticated and user.role in ('ADMIN', 'MANAGER')
+
+
+def paginate(request, queryset, ordering):
+    """Return the keyset page selected by the ``cursor`` query parameter."""
+    paginator = KeysetPaginator(queryset, ordering, per_page=PAGE_SIZE)
+    try:
+        return paginator.get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return paginator.get_page()
+
+
 def login_view(request):
     """Login view - landing page for all users."""
     if request.user.is_authenticated:
         return redirect('dashboard')
     
     if request.method == 'POST':
-        form = LoginForm(request.POST)
+        form = LoginForm(request, data=request.POST)
         if form.is_valid():
-            username = form.cleaned_data['username']
-            password = form.cleaned_data['password']
-            user = authenticate(request, u_name=username, password=password)
-            
-            if user is not None:
-                login(request, user)
-                messages.success(request, f'Welcome back, {user.full_name}!')
-                next_url = request.GET.get('next', 'dashboard')
-                return redirect(next_url)
-            else:
-                messages.error(request, 'Invalid username or password')
+            user = form.get_user()
+            login(request, user)
+            messages.success(request, f'Welcome back, {user.full_name}!')
+            next_url = request.GET.get('next', 'dashboard')
+            return redirect(next_url)
     else:
         form = LoginForm()
     
@@ -49,6 +72,7 @@ def dashboard_view(request):
     """Dashboard view - shows after login."""
     context = {
         'user': request.user,
+        'sales': rollups.dashboard(),
     }
     return render(request, 'dashboard.html', context)
 
@@ -60,18 +84,15 @@ def user_list_view(request):
     """List all users - admin only."""
     search_query = request.GET.get('search', '')
     
-    users = User.objects.all().order_by('-date_joined')
+    users = User.objects.all()
     
     if search_query:
-        users = users.filter(
-            Q(f_name__icontains=search_query) |
-            Q(l_name__icontains=search_query) |
-            Q(u_name__icontains=search_query) |
-            Q(email__icontains=search_query)
-        )
+        users = search.filter_queryset(users, search_query)
     
+    page = paginate(request, users, ['-date_joined', '-id'])
     context = {
-        'users': users,
+        'users': page,
+        'page': page,
         'search_query': search_query,
     }
     return render(request, 'users/list.html', context)
@@ -147,13 +168,15 @@ def category_list_view(request):
     """List all categories."""
     search_query = request.GET.get('search', '')
     
-    categories = Category.objects.all().order_by('name')
+    categories = Category.objects.with_product_totals()
     
     if search_query:
-        categories = categories.filter(name__icontains=search_query)
+        categories = search.filter_queryset(categories, search_query)
     
+    page = paginate(request, categories, ['name', 'id'])
     context = {
-        'categories': categories,
+        'categories': page,
+        'page': page,
         'search_query': search_query,
     }
     return render(request, 'categories/list.html', context)
@@ -203,7 +226,7 @@ def category_update_view(request, category_id):
 @login_required
 def category_delete_view(request, category_id):
     """Delete a category."""
-    category = get_object_or_404(Category, id=category_id)
+    category = get_object_or_404(Category.objects.with_product_totals(), id=category_id)
     
     if request.method == 'POST':
         category_name = category.name
@@ -215,3 +238,327 @@ def category_delete_view(request, category_id):
         'category': category,
     }
     return render(request, 'categories/delete.html', context)
+
+
+# Reports (Managers and admins)
+@login_required
+@user_passes_test(is_manager, login_url='dashboard')
+@require_GET
+def report_export_view(request, kind, fmt):
+    """Stream an export as CSV or NDJSON, filtered by ?start=&end= dates."""
+    if kind not in exports.EXPORTS or fmt not in exports.FORMATS:
+        raise Http404('Unknown export')
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return JsonResponse({'error': 'Dates must be YYYY-MM-DD'}, status=400)
+    response = StreamingHttpResponse(
+        exports.stream(kind, fmt, start, end), content_type=exports.FORMATS[fmt],
+    )
+    filename = f'{kind}-{timezone.localdate().isoformat()}.{fmt}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# Monitoring (Admin only)
+@login_required
+@user_passes_test(is_admin, login_url='dashboard')
+@require_GET
+def metrics_api(request):
+    """Latency histogram, query count and render time per view, for this process."""
+    return JsonResponse({'buckets_ms': instrumentation.BUCKETS, 'views': instrumentation.histogram.snapshot()})
+
+
+# POS APIs (All authenticated users)
+@login_required
+def product_search_api(request):
+    """Ranked product search by name or barcode prefix."""
+    query = request.GET.get('q', '')
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), 100))
+    except ValueError:
+        return JsonResponse({'error': '"limit" must be an integer'}, status=400)
+    products = search.ranked(Product.objects.all(), query, limit=limit)
+    results = [
+        {
+            'id': product.id,
+            'name': product.name,
+            'barcode': product.barcode,
+            'price': str(product.price),
+            'qty': product.qty,
+        }
+        for product in products
+    ]
+    return JsonResponse({'results': results})
+
+
+# The hot till endpoints below are async: under ASGI (pos_system.asgi) a
+# worker serves many idle till connections without a thread each. Cache
+# hits never leave the event loop; queries run through the async ORM and
+# checkout's transaction in a worker thread.
+@login_required
+@require_GET
+async def barcode_lookup_api(request, barcode):
+    """Resolve a single scanned barcode."""
+    product = await lookup.aresolve(barcode)
+    if product is None:
+        return JsonResponse({'error': f'No product with barcode {barcode}'}, status=404)
+    return JsonResponse(product)
+
+
+@login_required
+@require_POST
+async def barcode_bulk_lookup_api(request):
+    """Resolve a batch of scanned barcodes in one call."""
+    try:
+        barcodes = json.loads(request.body)['barcodes']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body like {"barcodes": [...]}'}, status=400)
+    if not isinstance(barcodes, list) or not all(isinstance(code, str) for code in barcodes):
+        return JsonResponse({'error': '"barcodes" must be a list of strings'}, status=400)
+    if len(barcodes) > MAX_BULK_BARCODES:
+        return JsonResponse({'error': f'At most {MAX_BULK_BARCODES} barcodes per request'}, status=400)
+    products = await lookup.aresolve_many(barcodes)
+    missing = [code for code in dict.fromkeys(barcodes) if code not in products]
+    return JsonResponse({'products': products, 'missing': missing})
+
+
+@login_required
+@require_POST
+async def cart_price_api(request):
+    """Price a cart without checking out; same body as :func:`sale_create_api`."""
+    try:
+        payload = json.loads(request.body)
+        products, details, total_price = await checkout.aprice_cart(
+            payload['items'], discount=payload.get('discount', 0),
+        )
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body like {"items": [...]}'}, status=400)
+    except checkout.InvalidCart as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    lines = [
+        {
+            'product': detail.product_id,
+            'name': products[detail.product_id].name,
+            'qty': detail.qty,
+            'price': str(detail.price),
+            'discount': str(detail.discount),
+            'total': str(detail.total),
+            'in_stock': products[detail.product_id].qty >= detail.qty,
+        }
+        for detail in details
+    ]
+    subtotal = sum(detail.total for detail in details)
+    return JsonResponse({
+        'lines': lines,
+        'subtotal': str(subtotal),
+        'discount': str(subtotal - total_price),
+        'total_price': str(total_price),
+    })
+
+
+@login_required
+@require_POST
+async def sale_create_api(request):
+    """Check out a cart: {"items": [{"product": id, "qty": n}], "discount": "0"}."""
+    try:
+        payload = json.loads(request.body)
+        sale = await sync_to_async(checkout.checkout)(payload['items'], discount=payload.get('discount', 0))
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body like {"items": [...]}'}, status=400)
+    except checkout.OutOfStock as exc:
+        return JsonResponse({'error': str(exc), 'product': exc.product.id}, status=409)
+    except IntegrityError:
+        return JsonResponse({'error': 'Could not allocate a free sale code, retry'}, status=409)
+    except checkout.InvalidCart as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({
+        'id': sale.id,
+        'code': sale.code,
+        'total_price': str(sale.total_price),
+        'discount': str(sale.discount),
+    }, status=201)
+
+
+@login_required
+@require_GET
+@gzip_page
+def catalog_api(request):
+    """Product catalog: a full snapshot, or the changes after ?since=<version>.
+
+    Answers 304 when If-None-Match holds the ETag of the current version.
+    """
+    fmt = request.GET.get('format', 'columns')
+    if fmt not in catalog.FORMATS:
+        return JsonResponse({'error': f'Unsupported format {fmt!r}'}, status=400)
+    try:
+        since = int(request.GET['since']) if request.GET.get('since') else None
+    except ValueError:
+        return JsonResponse({'error': '"since" must be a catalog version'}, status=400)
+    version = catalog.current_version()
+    etag = catalog.etag(version, fmt)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(catalog.render(version, since, fmt), content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@login_required
+@require_POST
+def offline_sales_api(request):
+    """Upload sales made offline: {"till": id, "sales": [{"code", "date", "items": [...]}]}."""
+    try:
+        payload = json.loads(request.body)
+        report = offline.upload_sales(payload['sales'], payload['till'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body like {"till": "...", "sales": [...]}'}, status=400)
+    except offline.SyncError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    except IntegrityError:
+        # Another upload from this till stored one of these sales first; a
+        # retry reports it as a duplicate.
+        return JsonResponse({'error': 'Sales were uploaded concurrently, retry'}, status=409)
+    return JsonResponse({
+        'created': report.created,
+        'duplicates': report.duplicates,
+        'rejected': [{'code': code, 'error': error} for code, error in report.rejected],
+    })
+
+
+@login_required
+@require_GET
+async def events_api(request):
+    """Server-sent feed of product price/qty changes and new sales.
+
+    EventSource reconnects with ``Last-Event-ID`` and receives the events it
+    missed, or a ``reset`` event when they are no longer available. Only
+    served under ASGI: a WSGI server would buffer the endless stream in a
+    worker thread and never send a byte.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'error': 'Live events need the ASGI server (pos_system.asgi); poll /api/catalog/ instead'},
+            status=501,
+        )
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return JsonResponse({'error': 'Last-Event-ID must be an event id'}, status=400)
+    response = StreamingHttpResponse(events.stream(last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@user_passes_test(is_manager, login_url='dashboard')
+@require_POST
+def stock_receive_api(request):
+    """Receive a delivery uploaded as a CSV or newline-delimited JSON ``file``."""
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'Upload the delivery as "file"'}, status=400)
+    fmt = request.POST.get('format') or ('json' if upload.name.endswith(('.json', '.jsonl', '.ndjson')) else 'csv')
+    if fmt not in receiving.FORMATS:
+        return JsonResponse({'error': f'Unsupported format {fmt!r}'}, status=400)
+    try:
+        report = receiving.receive(
+            receiving.iter_rows(upload.file, fmt),
+            code=request.POST.get('code') or None,
+            discount=request.POST.get('discount') or 0,
+            skip_invalid=request.POST.get('skip_invalid') == '1',
+        )
+    except (receiving.ReceivingError, receiving.InvalidFile) as exc:
+        return JsonResponse({'error': str(exc), 'errors': exc.errors[:100]}, status=400)
+    return JsonResponse({
+        'id': report.stock.id,
+        'code': report.stock.code,
+        'total_cost': str(report.stock.total_cost),
+        'rows': report.rows,
+        'lines': report.lines,
+        'units': report.units,
+        'skipped': report.errors[:100],
+        'rows_per_second': round(report.rows_per_second),
+    }, status=201)
+
+
+@login_required
+@user_passes_test(is_manager, login_url='dashboard')
+@require_POST
+def product_import_api(request):
+    """Create or update products by barcode from an uploaded CSV or NDJSON ``file``."""
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'Upload the products as "file"'}, status=400)
+    fmt = request.POST.get('format') or ('json' if upload.name.endswith(('.json', '.jsonl', '.ndjson')) else 'csv')
+    if fmt not in receiving.FORMATS:
+        return JsonResponse({'error': f'Unsupported format {fmt!r}'}, status=400)
+    try:
+        report = bulk.import_products(
+            receiving.iter_rows(upload.file, fmt), skip_invalid=request.POST.get('skip_invalid') == '1',
+        )
+    except (bulk.ProductImportError, receiving.InvalidFile) as exc:
+        return JsonResponse({'error': str(exc), 'errors': exc.errors[:100]}, status=400)
+    return JsonResponse({
+        'rows': report.rows,
+        'created': report.created,
+        'updated': report.updated,
+        'without_barcode': report.without_barcode,
+        'skipped': report.errors[:100],
+        'rows_per_second': round(report.rows_per_second),
+    })
+
+
+@login_required
+@user_passes_test(is_manager, login_url='dashboard')
+@require_POST
+def product_prices_api(request):
+    """Reprice products: {"percent": "5", "amount": "0.10", "categories": [id, ...]}."""
+    try:
+        payload = json.loads(request.body)
+        categories = payload.get('categories')
+        products = Product.objects.all()
+        if categories is not None:
+            if not isinstance(categories, list):
+                raise TypeError(categories)
+            products = products.filter(category__in=[int(category) for category in categories])
+    except (AttributeError, ValueError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body like {"percent": "5", "categories": [...]}'}, status=400)
+    try:
+        count = bulk.change_prices(products, percent=payload.get('percent'), amount=payload.get('amount'))
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({'repriced': count})
+
+
+@login_required
+@user_passes_test(is_manager, login_url='dashboard')
+@require_http_methods(['GET', 'POST'])
+def reorder_api(request):
+    """Products running low (?cover_days=&target_days=); POST writes draft purchase orders."""
+    params = request.POST if request.method == 'POST' else request.GET
+    try:
+        cover_days = float(params.get('cover_days') or reorder.COVER_DAYS)
+        target_days = float(params.get('target_days') or reorder.TARGET_DAYS)
+    except ValueError:
+        return JsonResponse({'error': '"cover_days" and "target_days" must be numbers'}, status=400)
+    products = list(reorder.suggestions(cover_days, target_days))
+    data = {
+        'products': [{
+            'id': product.id,
+            'name': product.name,
+            'qty': product.qty,
+            'velocity': round(product.current_velocity, 3),
+            'cover_days': round(product.current_cover, 1),
+            'order_qty': int(product.order_qty),
+        } for product in products],
+    }
+    if request.method == 'GET':
+        return JsonResponse(data)
+    drafts = reorder.create_drafts(products)
+    data['drafts'] = [{'id': draft.id, 'code': draft.code, 'total_cost': str(draft.total_cost)} for draft in drafts]
+    return JsonResponse(data, status=201)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,18 +56,27 @@ ROOT_URLCONF = 'pos_system.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to core.instrumentation.
+        'BACKEND': 'core.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [
             BASE_DIR / 'templates',
             BASE_DIR / 'startbootstrap-sb-admin-gh-pages'
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.navigation',
+            ],
+            # Parse each template once per process. The development server
+            # still picks up edits: its autoreloader resets this cache.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
             ],
         },
     },
@@ -77,11 +88,65 @@ WSGI_APPLICATION = 'pos_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# SQLite by default, for development and single-till shops. Multi-till
+# stores set POS_DB_ENGINE=postgresql and the POS_DB_* variables below
+# (requires `pip install "psycopg[binary,pool]"`).
+
+POS_DB_ENGINE = os.environ.get('POS_DB_ENGINE', 'sqlite')
+
+if POS_DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POS_DB_NAME', 'pos'),
+            'USER': os.environ.get('POS_DB_USER', 'pos'),
+            'PASSWORD': os.environ.get('POS_DB_PASSWORD', ''),
+            'HOST': os.environ.get('POS_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('POS_DB_PORT', '5432'),
+            # Drop connections the server closed instead of failing a request.
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
+    if int(os.environ.get('POS_DB_POOL_MAX_SIZE', 0)):
+        # psycopg's pool shared by all threads of a worker process; it keeps
+        # connections open itself, so Django's own persistence must be off.
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get('POS_DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ['POS_DB_POOL_MAX_SIZE']),
+                'timeout': int(os.environ.get('POS_DB_POOL_TIMEOUT', 10)),
+            },
+        }
+    else:
+        # One persistent connection per worker thread, reused for this long.
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('POS_DB_CONN_MAX_AGE', 60))
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('POS_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Write transactions take the lock up front and wait for it
+                # (busy_timeout below), rather than failing with "database
+                # is locked" when a read is upgraded mid-transaction.
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+# Applied to every new SQLite connection (core.signals.configure_sqlite).
+# WAL lets readers run alongside the single writer; synchronous=NORMAL is
+# durable across application crashes and only fsyncs at WAL checkpoints.
+# cache_size is negative KiB (32 MiB per connection).
+POS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -32000,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
 }
 
 
@@ -125,11 +190,29 @@ STATICFILES_DIRS = [
     BASE_DIR / 'startbootstrap-sb-admin-gh-pages' / 'css',
     BASE_DIR / 'startbootstrap-sb-admin-gh-pages' / 'js',
 ]
+# `manage.py build_assets` collects minified, hashed and precompressed copies
+# here (see core.assets). Set POS_SERVE_STATIC to have Django serve them with
+# far-future cache headers when no front-end server does.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'core.assets.PrecompressedManifestStaticFilesStorage',
+    },
+}
+POS_SERVE_STATIC = False
 
 # Media files (User uploads)
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Thumbnails generated for Product.image and User.profile uploads
+# (see core.thumbnails); 0 workers renders them inline after commit.
+POS_THUMBNAIL_SIZES = (64, 256)
+POS_THUMBNAIL_WORKERS = 2
+
 # Custom user model
 AUTH_USER_MODEL = 'core.User'
 
@@ -139,6 +222,30 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # {% cache %} fragments of templates/base.html (navbar and sidebar menus).
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template-fragments',
+    },
+}
+
+# Session users can be cached instead of loaded on every request (see
+# core.backends). POS_USER_CACHE names the cache; it must be shared by all
+# worker processes (e.g. Redis or Memcached) so deactivations and role
+# changes made in one apply in all of them, which the system checks
+# enforce. Unset, users are loaded from the database.
+POS_USER_CACHE = None
+POS_USER_CACHE_TIMEOUT = 300
+
 # Authentication settings
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'
@@ -148,3 +255,56 @@ LOGOUT_REDIRECT_URL = '/login/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# POS barcode lookup cache (per worker process)
+# MAXSIZE: number of barcodes kept; TTL: seconds before a cached entry is
+# re-read, bounding staleness for changes made in other processes.
+POS_BARCODE_CACHE = {
+    'MAXSIZE': 4096,
+    'TTL': 30,
+}
+
+# Live change feed for tills at /api/events/ (see core.events)
+# BACKEND: broker class; the in-process default only reaches tills connected
+# to the same worker process. BACKLOG: events kept for reconnecting tills
+# (and buffered per till). HEARTBEAT: idle seconds between keepalives.
+POS_EVENTS = {
+    'BACKEND': 'core.events.InProcessBroker',
+    'BACKLOG': 1000,
+    'HEARTBEAT': 15,
+}
+
+# Sale and stock codes (see core.codes), e.g. POS-S01-20261018-00042.
+# NAMESPACE: prefix reserved for allocated codes (client-supplied codes
+# may not use it); STORE: optional store prefix; BLOCK_SIZE: numbers each
+# worker process reserves at a time (larger blocks mean fewer updates and
+# larger gaps).
+POS_CODES = {
+    'NAMESPACE': 'POS-',
+    'STORE': '',
+    'BLOCK_SIZE': 20,
+}
+
+# Offline tills (see core.offline): most sales accepted per upload.
+POS_OFFLINE_MAX_SALES = 500
+
+# Reordering (see core.reorder): sales velocity is averaged over about
+# VELOCITY_DAYS; products with less than COVER_DAYS of stock left are
+# flagged, and draft purchase orders top them up to TARGET_DAYS.
+POS_REORDER = {
+    'VELOCITY_DAYS': 14,
+    'COVER_DAYS': 7,
+    'TARGET_DAYS': 28,
+}
+
+# Request instrumentation (see core.instrumentation)
+# SERVER_TIMING: send query count, DB, template and total time in a
+# Server-Timing header to every client (development only).
+# SLOW_REQUEST_MS: log requests at least this slow (None disables) to the
+# core.instrumentation logger, with their SLOW_REQUEST_SQL most expensive
+# statements.
+POS_INSTRUMENTATION = {
+    'SERVER_TIMING': DEBUG,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_REQUEST_SQL': 10,
+}
@@ -15,17 +15,25 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 from django.shortcuts import redirect
 
+from core import assets
+
 urlpatterns = [
     path('', lambda request: redirect('login'), name='landing'),
     path('', include('core.urls')),
     path('admin/', admin.site.urls),
 ]
 
+# Serve built static assets (manage.py build_assets) without a front-end server
+if settings.POS_SERVE_STATIC:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), assets.serve),
+    ]
+
 # Serve media files in development
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)